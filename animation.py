@@ -1,194 +1,526 @@
 import cv2
 import bpy
 import os
-from math import radians, sin
 import shutil
 import numpy as np
-import glob
-import time
+import json
+import hashlib
 
 import argparse
-
-parser = argparse.ArgumentParser()
-parser.add_argument("-l", "--logo", type=str, help="The logo png file.")
-parser.add_argument("-g", "--glb", type=str, help="The glb files.")
-parser.add_argument("-f", "--folder", type=str, help="Select the folder.")
-
-args = parser.parse_args()
-
-def calculate_new_rotate(bone_name, angle_deg):
-    angle_rad = radians(angle_deg)
-    if bone_name == 'Arm.R' or bone_name == 'Arm.L':
-        return (1.0, sin(angle_rad)/1.7, 0, 0)
-    if bone_name == 'Leg.L':
-        angle_rad += radians(90)
-        return (1.0, 0, 0, sin(angle_rad) + 0.25)
-    if bone_name == 'Leg.R':
-        angle_rad += radians(90)
-        return (1.0, 0, 0, sin(angle_rad) - 0.25)
-    if bone_name == 'Hand.R':
-        return (1.0, -1 * sin(angle_rad), 0, 0)
-    if bone_name == 'Hand.L':
-        return (1.0, sin(angle_rad), 0, 0)
-    if bone_name == 'Foot.R':
-        return (1.0, 0, 0, -1 * sin(angle_rad))
-    if bone_name == 'Foot.L':
-        return (1.0, 0, 0, -1 * sin(angle_rad))
-
-def update_bone_rotations(data, armature):
-    new_angles = {
-        'Arm.R': data['RightShoulder'],
-        'Arm.L': data['LeftShoulder'],
-        'Leg.R': data['RHipJoint'],
-        'Leg.L': data['LHipJoint'],
-        'Hand.R': data['RightArm'],
-        'Hand.L': data['LeftArm'],
-        'Foot.R': data['RightLeg'],
-        'Foot.L': data['LeftLeg'],
-    }
-    armature.location.z = data['y_position']
-    armature.location.x = data['x_position']
-
-    for bone_name, angle in new_angles.items():
+import sys
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Blender does not put the script folder on sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from video_encoder import FrameEncoder
+from watcher import wait_until, wait_for_paths, wait_for_removal, file_signature, paths_signature, last_modified, MARKER_SUFFIX
+from pose_track import PoseTrack, ROTATION_MODES
+import profiling
+
+FRAMES_PER_SCENE = 30
+
+# Scene settings every frame is rendered with; they are part of each frame's manifest hash
+BACKGROUND_COLOR = (0, 0, 0, 1)
+LIGHT_LOCATION = (0, -5, 0)
+LIGHT_ENERGY = 1000  # Adjust the energy level as needed
+LIGHT_SHADOW_SOFT_SIZE = 0.1
+CAMERA_LOCATION = (0, -5, 0)
+CAMERA_ROTATION = (1.61, 0, 0)
+RESOLUTION = (1920, 1080)
+
+MANIFEST_NAME = 'manifest.json'
+
+def update_bone_rotations(armature, track, values, quaternions):
+    # values: one row of the interpolated track; quaternions: bone name -> (w, x, y, z)
+    armature.location.z = values[track.index['y_position']]
+    armature.location.x = values[track.index['x_position']]
+
+    for bone_name, new_rotate in quaternions.items():
         bone = armature.pose.bones.get(bone_name)
         if bone:
-            new_rotate = calculate_new_rotate(bone_name, angle)
             bone.rotation_quaternion = new_rotate
-            print(f"{bone_name} bone rotated to {new_rotate}")
-
-def read_bone_data(file_path):
-    data = {}
-    with open(file_path, 'r') as f:
-        for line in f:
-            key, value = line.split(':')
-            data[key.strip()] = float(value.strip())
-    return data
-
-def interpolate_data(data_start, data_end, factor):
-    interpolated_data = {}
-    for key in data_start.keys():
-        interpolated_data[key] = data_start[key] + (data_end[key] - data_start[key]) * factor
-    return interpolated_data
-
-while not os.path.exists(args.glb):
-    time.sleep(1)
-
-bpy.context.scene.world.use_nodes = True
-bg_node = bpy.context.scene.world.node_tree.nodes['Background']
-bg_node.inputs[0].default_value = (0, 0, 0, 1)
-
-bpy.ops.object.light_add(type='POINT', location=(0, -5, 0))
-light = bpy.context.object
-light.data.energy = 1000  # Adjust the energy level as needed
-light.data.shadow_soft_size = 0.1
-bpy.ops.object.select_all(action='DESELECT')
-bpy.data.objects['Cube'].select_set(True)
-bpy.ops.object.delete()
-
-glb_path = args.glb
-bpy.ops.import_scene.gltf(filepath=glb_path)
-
-for area in bpy.context.screen.areas:
-    if area.type == 'VIEW_3D':
-        for space in area.spaces:
-            if space.type == 'VIEW_3D':
-                space.shading.type = 'RENDERED'
-                break
-
-bpy.context.scene.render.resolution_x = 1920
-bpy.context.scene.render.resolution_y = 1080
-current_directory = os.getcwd()
-
-scene_dirs = sorted([d for d in os.listdir(current_directory) if os.path.isdir(d) and d.startswith("scene_") and d.endswith("_animation")])
-
-bpy.ops.object.select_all(action='DESELECT')
-armature = None
-for obj in bpy.context.scene.objects:
-    if obj.type == 'ARMATURE':
-        armature = obj
-        armature.select_set(True)
-        bpy.context.view_layer.objects.active = armature
-        bpy.ops.object.mode_set(mode='POSE')
-        break
-
-if not armature:
-    raise RuntimeError("No armature found in the scene.")
-
-if os.path.exists(args.folder + '/scene'):
-    shutil.rmtree(args.folder + '/scene')
-    time.sleep(2)
-os.mkdir(args.folder + '/scene')
-
-count = 0
-for i in range(len(scene_dirs) - 1):
-    start_file_path = os.path.join(scene_dirs[i], "1.txt")
-    end_file_path = os.path.join(scene_dirs[i+1], "1.txt")
-
-    if os.path.isfile(start_file_path) and os.path.isfile(end_file_path):
-        start_data = read_bone_data(start_file_path)
-        end_data = read_bone_data(end_file_path)
+            print(f"{bone_name} bone rotated to {tuple(new_rotate)}")
+
+def find_scene_dirs(current_directory):
+    return sorted([d for d in os.listdir(current_directory) if os.path.isdir(d) and d.startswith("scene_") and d.endswith("_animation")])
+
+def scene_dirs_signature(current_directory):
+    # None until at least two scene_*_animation folders have their 1.txt, 'ready' once every folder
+    # has its .done marker, else the 1.txt signatures
+    scene_dirs = find_scene_dirs(current_directory)
+    if len(scene_dirs) < 2:
+        return None
+    if all(os.path.exists(d + MARKER_SUFFIX) for d in scene_dirs):
+        return 'ready'
+    signatures = tuple((d, file_signature(os.path.join(d, "1.txt"))) for d in scene_dirs)
+    return None if any(s is None for _, s in signatures) else signatures
+
+def wait_for_inputs(glb_path, current_directory, timeout=None, settle=1.0):
+    # Wait for the GLB and the scene folders in one go, so their settle windows overlap.
+    # Without a timeout the scene folders have to exist already; only their writes are waited for
+    scene_dirs = find_scene_dirs(current_directory)
+    if timeout is None and len(scene_dirs) < 2:
+        raise RuntimeError(f"Found {len(scene_dirs)} scene_*_animation folder(s) in {current_directory}, at least two are needed; "
+                           "pass --wait-timeout to wait for them.")
+
+    def signature():
+        signatures = (paths_signature([glb_path]), scene_dirs_signature(current_directory))
+        if None in signatures:
+            return None
+        return 'ready' if signatures == ('ready', 'ready') else signatures
+
+    def modified():
+        return last_modified([glb_path] + [os.path.join(d, "1.txt") for d in find_scene_dirs(current_directory)])
+
+    wait_until(signature, lambda: [glb_path, current_directory] + find_scene_dirs(current_directory), timeout, settle, modified)
+
+def frame_path(folder, index):
+    return folder + '/scene/frame_' + str(index) + '/frame.png'
+
+def setup_scene(glb_path=None, view_transform=None):
+    # Light, background, resolution and (if given) view transform for the render; without glb_path
+    # the rigged character is expected to be in the scene already (see pipeline.py)
+    bpy.context.scene.world.use_nodes = True
+    bg_node = bpy.context.scene.world.node_tree.nodes['Background']
+    bg_node.inputs[0].default_value = BACKGROUND_COLOR
+
+    bpy.ops.object.light_add(type='POINT', location=LIGHT_LOCATION)
+    light = bpy.context.object
+    light.data.energy = LIGHT_ENERGY
+    light.data.shadow_soft_size = LIGHT_SHADOW_SOFT_SIZE
+    cube = bpy.data.objects.get('Cube')
+    if cube:
+        bpy.data.objects.remove(cube, do_unlink=True)
+
+    if glb_path:
+        with profiling.stage('import', file_bytes=os.path.getsize(glb_path)):
+            bpy.ops.import_scene.gltf(filepath=glb_path)
+
+    for area in bpy.context.screen.areas if bpy.context.screen else []:
+        if area.type == 'VIEW_3D':
+            for space in area.spaces:
+                if space.type == 'VIEW_3D':
+                    space.shading.type = 'RENDERED'
+                    break
+
+    bpy.context.scene.render.resolution_x, bpy.context.scene.render.resolution_y = RESOLUTION
+    if view_transform:
+        bpy.context.scene.view_settings.view_transform = view_transform
+
+    bpy.ops.object.select_all(action='DESELECT')
+    armature = None
+    for obj in bpy.context.scene.objects:
+        if obj.type == 'ARMATURE':
+            armature = obj
+            armature.select_set(True)
+            bpy.context.view_layer.objects.active = armature
+            bpy.ops.object.mode_set(mode='POSE')
+            break
+
+    if not armature:
+        raise RuntimeError("No armature found in the scene.")
+    return armature
+
+def prepare_output(folder, count, force=False):
+    # Keep the frames of earlier runs so unchanged ones can be reused; only a forced run starts from scratch
+    scene_folder = folder + '/scene'
+    if force and os.path.exists(scene_folder):
+        shutil.rmtree(scene_folder)
+        wait_for_removal(scene_folder, timeout=30)
+    os.makedirs(scene_folder, exist_ok=True)
+
+    # Frames past the end of a now shorter sequence, and staging folders of interrupted baked renders
+    for name in os.listdir(scene_folder):
+        index = name[len('frame_'):]
+        if (name.startswith('frame_') and index.isdigit() and int(index) >= count) or name.startswith('baked_'):
+            shutil.rmtree(os.path.join(scene_folder, name))
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def scene_settings(glb_path, view_transform=None, **extra):
+    # Everything besides the pose that changes how a frame looks; extra holds settings of
+    # earlier stages when the character is built in the same session (pipeline.py)
+    return {
+        **extra,
+        'glb': file_hash(glb_path),
+        'background': BACKGROUND_COLOR,
+        'light': [LIGHT_LOCATION, LIGHT_ENERGY, LIGHT_SHADOW_SOFT_SIZE],
+        'camera': [CAMERA_LOCATION, CAMERA_ROTATION],
+        'resolution': RESOLUTION,
+        'view_transform': view_transform,
+    }
 
-        for j in range(30): 
-            factor = j / 30.0
-            interpolated_data = interpolate_data(start_data, end_data, factor)
-            update_bone_rotations(interpolated_data, armature)
+def frame_hashes(track, settings, rotation='linear'):
+    # One hash per global frame index over its interpolated pose row, bone rotations and the scene settings
+    values, quaternions = pose_frames(track, rotation)
+    rows = np.concatenate([values] + list(quaternions.values()), axis=1)
+    prefix = json.dumps([settings, track.channels, list(quaternions)], sort_keys=True).encode()
+    return [hashlib.blake2b(prefix + row.tobytes(), digest_size=16).hexdigest() for row in rows]
+
+def manifest_path(folder):
+    return folder + '/scene/' + MANIFEST_NAME
+
+def load_manifest(folder):
+    try:
+        with open(manifest_path(folder), 'r') as f:
+            return json.load(f)['frames']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def save_manifest(folder, hashes):
+    # Written after rendering and swapped in atomically, so an interrupted run never records frames it did not render
+    temp_path = manifest_path(folder) + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'frames': {str(i): frame_hash for i, frame_hash in enumerate(hashes)}}, f, indent=1)
+    os.replace(temp_path, manifest_path(folder))
+
+def dirty_frames(folder, hashes):
+    # Frames whose hash differs from the last run, or whose PNG is missing
+    previous = load_manifest(folder)
+    return [i for i, frame_hash in enumerate(hashes)
+            if previous.get(str(i)) != frame_hash or not os.path.isfile(frame_path(folder, i))]
+
+def frame_ranges(frames):
+    # Sorted frame indices as contiguous (start, end) runs
+    ranges = []
+    for index in sorted(frames):
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+    return [tuple(r) for r in ranges]
+
+def format_frames(frames):
+    return ','.join(f'{start}:{end}' for start, end in frame_ranges(frames))
+
+def parse_frames(text):
+    frames = []
+    for part in text.split(','):
+        start, end = [int(value) for value in part.split(':')]
+        frames.extend(range(start, end))
+    return frames
+
+def pose_frames(track, rotation='linear'):
+    # Interpolated (frames, channels) values and bone name -> (frames, 4) quaternions for every global frame
+    values = track.interpolate(FRAMES_PER_SCENE)
+    return values, track.bone_quaternions(FRAMES_PER_SCENE, rotation, values)
+
+def render_frames(armature, track, folder, frames=None, encoder=None, write_frames=True, rotation='linear'):
+    # Render every interpolated frame, or only the global frame indices in `frames`.
+    # With an encoder, each rendered frame goes straight from the render result into the video.
+    current_directory = os.getcwd()
+    if encoder:
+        setup_render_capture()
+    values, quaternions = pose_frames(track, rotation)
+    width_ratio, height_ratio = track.column(values, 'width_ratio'), track.column(values, 'height_ratio')
+    for count in range(len(values)):
+        if frames is not None and count not in frames:
+            # Unchanged frame from an earlier run: feed the PNG on disk to the video instead
+            if encoder:
+                encoder.write(cv2.imread(frame_path(folder, count)))
+            continue
+
+        update_bone_rotations(armature, track, values[count], {bone_name: rotations[count] for bone_name, rotations in quaternions.items()})
+
+        armature.scale = (width_ratio[count], height_ratio[count], 1)
+        bpy.context.view_layer.update()
+        bpy.context.view_layer.objects.active = armature
+        bpy.ops.object.mode_set(mode='OBJECT')
 
-            armature.scale = (interpolated_data['width_ratio'], interpolated_data['height_ratio'], 1)
-            bpy.context.view_layer.update()
-            bpy.context.view_layer.objects.active = armature
-            bpy.ops.object.mode_set(mode='OBJECT')
+        bpy.ops.object.camera_add(location=CAMERA_LOCATION)
+        camera = bpy.context.object
+        bpy.context.scene.camera = camera
+        camera.rotation_euler = CAMERA_ROTATION
 
-            bpy.ops.object.camera_add(location=(0, -5, 0))
-            camera = bpy.context.object
-            bpy.context.scene.camera = camera
-            camera.rotation_euler = (1.61, 0, 0)  
+        if write_frames:
+            os.makedirs(folder + '/scene/frame_' + str(count), exist_ok=True)
+            output_image_name = frame_path(folder, count)
 
-            os.mkdir(args.folder + '/scene/frame_' + str(count))
-            output_image_name = args.folder + '/scene/frame_' + str(count) + '/frame.png'
-            
-            count += 1
             output_image_path = os.path.join(current_directory, output_image_name)
             bpy.context.scene.render.filepath = output_image_path
             bpy.ops.render.render(write_still=True)
 
             print(f"Image saved to {output_image_path}")
+        else:
+            bpy.ops.render.render()
 
-            bpy.ops.object.select_all(action='DESELECT')
-            bpy.data.objects[camera.name].select_set(True)
-            bpy.ops.object.delete()
+        if encoder:
+            encoder.write(capture_render())
 
-            armature.select_set(True)
-            bpy.context.view_layer.objects.active = armature
-            bpy.ops.object.mode_set(mode='POSE')
+        bpy.ops.object.select_all(action='DESELECT')
+        bpy.data.objects[camera.name].select_set(True)
+        bpy.ops.object.delete()
 
-print("All images have been rendered and saved.")
-time.sleep(3)
-logo = cv2.imread(args.logo)
-logo = cv2.resize(logo, (logo.shape[1] // 3, logo.shape[0] // 3)) 
-non_white_pixels = np.where((logo[:, :, :3] != [255, 255, 255]).any(axis=2))
-output_video_path = args.folder + '/scene/output.mp4'
-
-png_files = []
-img = cv2.imread(args.folder + "/scene/frame_0/frame.png")
-fps = 120
-video = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (img.shape[1], img.shape[0]))
-
-for i in range(30 * (len(scene_dirs) - 1)):
-    png_files.append(args.folder + "/scene/frame_" + str(i) + "/frame.png")
-print(png_files)
-for png_file in png_files:
-    print("hello", (png_file))
-    img = cv2.imread(png_file)
-    img[-logo.shape[0]-30:, -logo.shape[1]-30:][non_white_pixels] = logo[non_white_pixels]
-    video.write(img)
-    video.write(img)
-    video.write(img)
-    video.write(img)
-    video.write(img)
-    video.write(img)
-    video.write(img)
-    
-video.release()
+        armature.select_set(True)
+        bpy.context.view_layer.objects.active = armature
+        bpy.ops.object.mode_set(mode='POSE')
+
+def add_fcurve(action, data_path, index, frames, values, group):
+    # Keyframes at the given frames, written in bulk; LINEAR in between like the pose track
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+    fcurve.keyframe_points.add(len(values))
+    co = np.empty((len(values), 2), dtype=np.float32)
+    co[:, 0] = frames
+    co[:, 1] = values
+    fcurve.keyframe_points.foreach_set('co', co.ravel())
+    fcurve.keyframe_points.foreach_set('interpolation', [bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items['LINEAR'].value] * len(values))
+    fcurve.update()
+
+def bake_animation(armature, track, rotation='linear'):
+    # Turn the pose track into an action on the armature: frame i of the timeline is
+    # global frame index i, with the same values render_frames would set.
+    # Location and scale are linear between pose keyframes, so LINEAR keys at the keyframes
+    # (keyframe k at frame k * FRAMES_PER_SCENE) reproduce them exactly. The rotations are
+    # not linear per quaternion component in any mode, so those stay keyed on every frame
+    values, quaternions = pose_frames(track, rotation)
+    if not len(values):
+        raise RuntimeError("No pose frames to bake.")
+
+    action = bpy.data.actions.new(armature.name + 'Action')
+    armature.animation_data_create()
+    armature.animation_data.action = action
+
+    keyframes = np.arange(len(track.keys)) * FRAMES_PER_SCENE
+    add_fcurve(action, 'location', 0, keyframes, track.column(track.keys, 'x_position'), 'Object Transforms')
+    add_fcurve(action, 'location', 1, keyframes, np.full(len(keyframes), armature.location.y), 'Object Transforms')
+    add_fcurve(action, 'location', 2, keyframes, track.column(track.keys, 'y_position'), 'Object Transforms')
+    add_fcurve(action, 'scale', 0, keyframes, track.column(track.keys, 'width_ratio'), 'Object Transforms')
+    add_fcurve(action, 'scale', 1, keyframes, track.column(track.keys, 'height_ratio'), 'Object Transforms')
+    add_fcurve(action, 'scale', 2, keyframes, np.ones(len(keyframes)), 'Object Transforms')
+
+    frames = np.arange(len(values))
+
+    for bone_name, rotations in quaternions.items():
+        bone = armature.pose.bones.get(bone_name)
+        if not bone:
+            continue
+        bone.rotation_mode = 'QUATERNION'
+        for index in range(4):
+            add_fcurve(action, f'pose.bones["{bone_name}"].rotation_quaternion', index, frames, rotations[:, index], bone_name)
+
+    scene = bpy.context.scene
+    scene.frame_start = 0
+    scene.frame_end = len(values) - 1
+    return action
+
+def render_baked(folder, ranges=None):
+    # One persistent camera and an animation render per (start, end) range (default: the whole timeline),
+    # then move the files into scene/frame_<i>/frame.png
+    scene = bpy.context.scene
+    bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.ops.object.camera_add(location=CAMERA_LOCATION)
+    camera = bpy.context.object
+    camera.rotation_euler = CAMERA_ROTATION
+    scene.camera = camera
+
+    for start, end in ranges or [(scene.frame_start, scene.frame_end + 1)]:
+        scene.frame_start, scene.frame_end = start, end - 1
+        # Each range renders into its own staging folder
+        baked_folder = os.path.join(os.getcwd(), folder + '/scene/baked_' + str(start))
+        scene.render.image_settings.file_format = 'PNG'
+        scene.render.filepath = os.path.join(baked_folder, 'frame_####')
+        bpy.ops.render.render(animation=True)
+
+        for index in range(start, end):
+            os.makedirs(folder + '/scene/frame_' + str(index), exist_ok=True)
+            os.replace(scene.render.frame_path(frame=index), frame_path(folder, index))
+        os.rmdir(baked_folder)
+        print(f"Frames {start}-{end - 1} rendered")
+
+def export_baked_animation(armature, filepath):
+    # Export the character with its baked action, so clients can play it without rendering
+    bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.ops.object.select_all(action='DESELECT')
+    armature.select_set(True)
+    for child in armature.children:
+        child.select_set(True)
+    bpy.ops.export_scene.gltf(filepath=filepath, export_format='GLB', use_selection=True, export_animations=True)
+    print(f"Animation exported to {filepath}")
+
+def split_frames(frames, workers):
+    # Contiguous shards of the frames to render, one per worker
+    return [shard.tolist() for shard in np.array_split(np.asarray(sorted(frames), dtype=int), workers) if len(shard)]
+
+def render_shard(shard, args, retries, blender):
+    # Render one shard in a background Blender, retrying when it fails or leaves frames missing
+    label = f"Frames {shard[0]}-{shard[-1]}"
+    command = [blender, '--background', '--python', os.path.abspath(__file__), '--',
+               '-g', args.glb, '-f', args.folder, '-l', args.logo,
+               '--rotation', args.rotation, '--frames', format_frames(shard)] + (['--bake'] if args.bake else [])
+    if args.view_transform:
+        command += ['--view-transform', args.view_transform]
+    for attempt in range(retries + 1):
+        result = subprocess.run(command, cwd=os.getcwd(), stdout=subprocess.DEVNULL)
+        missing = [i for i in shard if not os.path.isfile(frame_path(args.folder, i))]
+        if result.returncode == 0 and not missing:
+            print(f"{label} rendered")
+            return True
+        print(f"{label} failed (exit code {result.returncode}, {len(missing)} missing), attempt {attempt + 1}/{retries + 1}")
+    return False
+
+def render_parallel(args, frames, workers, retries):
+    # bpy.app.binary_path is empty when this runs under the bpy module instead of Blender
+    blender = args.blender or bpy.app.binary_path
+    if not blender or not shutil.which(blender):
+        raise RuntimeError(f"Blender executable {blender!r} not found for the render workers; pass --blender or set BLENDER.")
+    shards = split_frames(frames, workers)
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        results = list(pool.map(lambda shard: render_shard(shard, args, retries, blender), shards))
+    if not all(results):
+        raise RuntimeError("Some frame shards could not be rendered.")
+
+def composite_video(folder, logo_path, count):
+    # Read the rendered frames back from disk and stream them into the encoder
+    encoder = FrameEncoder(folder + '/scene/output.mp4', logo_path=logo_path)
+    try:
+        for i in range(count):
+            encoder.write(cv2.imread(frame_path(folder, i)))
+    finally:
+        encoder.close()
+
+def render_scene(setup, track, folder, logo_path, dirty, bake=False, export_animation=None, stream=False, write_frames=False, rotation='linear'):
+    # Render the dirty frames in this process; setup() returns the posed armature and is only
+    # called when something has to be rendered or exported
+    if not dirty and not export_animation and not stream:
+        return
+    if bake or export_animation:
+        armature = setup()
+        with profiling.stage('bake', frames=track.frame_count(FRAMES_PER_SCENE)):
+            bake_animation(armature, track, rotation)
+        if export_animation:
+            with profiling.stage('export'):
+                export_baked_animation(armature, export_animation)
+        if dirty:
+            with profiling.stage('render', frames=len(dirty), width=RESOLUTION[0], height=RESOLUTION[1]):
+                render_baked(folder, frame_ranges(dirty))
+    elif stream:
+        # Without write_frames there are no PNGs to reuse, so every frame is rendered
+        armature = setup()
+        encoder = FrameEncoder(folder + '/scene/output.mp4', logo_path=logo_path)
+        try:
+            with profiling.stage('render', frames=len(dirty) if write_frames else track.frame_count(FRAMES_PER_SCENE), width=RESOLUTION[0], height=RESOLUTION[1], stream=True):
+                render_frames(armature, track, folder, set(dirty) if write_frames else None, encoder, write_frames, rotation)
+        finally:
+            encoder.close()
+    elif dirty:
+        armature = setup()
+        with profiling.stage('render', frames=len(dirty), width=RESOLUTION[0], height=RESOLUTION[1]):
+            render_frames(armature, track, folder, set(dirty), rotation=rotation)
+
+def render_animation(track, folder, logo_path, settings, render, force=False, streaming=False, write_frames=False, rotation='linear'):
+    # Only frames whose pose data or scene settings changed since the last run are rendered again:
+    # render(dirty) renders them, then the manifest is updated and the video composited
+    count = track.frame_count(FRAMES_PER_SCENE)
+    with profiling.stage('manifest', keyframes=len(track.keys), frames=count) as sizes:
+        prepare_output(folder, count, force)
+        hashes = frame_hashes(track, settings, rotation)
+        dirty = dirty_frames(folder, hashes)
+        sizes['dirty_frames'] = len(dirty)
+    print(f"{len(dirty)} of {count} frames need rendering")
+
+    render(dirty)
+    if write_frames or not streaming:
+        save_manifest(folder, hashes)
+
+    print("All images have been rendered and saved.")
+    if not streaming:
+        wait_for_paths([frame_path(folder, i) for i in range(count)], timeout=60, settle=0)
+        with profiling.stage('composite', frames=count):
+            composite_video(folder, logo_path, count)
+
+def setup_render_capture():
+    # Route the render through a compositor Viewer node so its pixels can be read without a file
+    scene = bpy.context.scene
+    scene.use_nodes = True
+    tree = scene.node_tree
+    render_layers = next((node for node in tree.nodes if node.type == 'R_LAYERS'), None) or tree.nodes.new('CompositorNodeRLayers')
+    viewer = next((node for node in tree.nodes if node.type == 'VIEWER'), None) or tree.nodes.new('CompositorNodeViewer')
+    tree.links.new(render_layers.outputs['Image'], viewer.inputs['Image'])
+
+    # The Viewer holds linear pixels and capture_render only sRGB-encodes them, which matches the saved
+    # PNGs only under the Standard view transform; Filmic/AgX tone mapping is not reproduced
+    if scene.view_settings.view_transform != 'Standard':
+        raise RuntimeError(f"Streaming needs the Standard view transform, the scene uses {scene.view_settings.view_transform}.")
+
+def capture_render():
+    viewer = bpy.data.images['Viewer Node']
+    width, height = viewer.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    viewer.pixels.foreach_get(pixels)
+    rgb = np.clip(pixels.reshape(height, width, 4)[::-1, :, 2::-1], 0.0, 1.0)
+
+    # Linear to sRGB, then 8-bit BGR as cv2.imread would give
+    srgb = np.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * np.power(rgb, 1 / 2.4) - 0.055)
+    return (srgb * 255.0 + 0.5).astype(np.uint8)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--logo", type=str, help="The logo png file.")
+    parser.add_argument("-g", "--glb", type=str, help="The glb files.")
+    parser.add_argument("-f", "--folder", type=str, help="Select the folder.")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Render the frames in this many background Blender processes.")
+    parser.add_argument("--retries", type=int, default=2, help="How often a failed frame shard is re-rendered.")
+    parser.add_argument("--blender", type=str, default=os.environ.get("BLENDER"), help="Blender executable for the render workers (default: the running Blender).")
+    parser.add_argument("--bake", action="store_true", help="Bake the poses into keyframes and render them with one animation render.")
+    parser.add_argument("--export-animation", type=str, help="Also export the baked action as a glTF animation to this GLB.")
+    parser.add_argument("--stream", action="store_true", help="Encode the video straight from the render result instead of re-reading PNGs (needs --view-transform Standard).")
+    parser.add_argument("--write-frames", action="store_true", help="With --stream, still write scene/frame_<i>/frame.png.")
+    parser.add_argument("--wait-timeout", type=float, help="Give up if the GLB and scene folders are not complete after this many seconds.")
+    parser.add_argument("--frames", type=str, help="Only render these global frame ranges, e.g. 0:30,60:90 (used by the workers).")
+    parser.add_argument("--rotation", type=str, default="linear", choices=ROTATION_MODES,
+                        help="Bone rotations: linear (as before), normalized (unit quaternions) or slerp between keyframes.")
+    parser.add_argument("--force", action="store_true", help="Re-render every frame instead of only those whose pose or scene settings changed.")
+    parser.add_argument("--view-transform", type=str, help="Color management view transform, e.g. Standard (default: the scene's, Filmic/AgX).")
+    profiling.add_arguments(parser)
+    # When run as 'blender --background --python animation.py -- ...', only parse what follows '--'
+    args = parser.parse_args(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else None)
+    if args.stream and args.view_transform != 'Standard':
+        parser.error("--stream encodes the render result without tone mapping; pass --view-transform Standard with it")
+    # Render workers pick the report up from the environment set by the coordinator
+    profiling.start_from_args(args)
+
+    if not args.frames:
+        # Start as soon as the inputs are completely written (stable size or a .done marker)
+        wait_for_inputs(args.glb, os.getcwd(), timeout=args.wait_timeout)
+
+    scene_dirs = find_scene_dirs(os.getcwd())
+    track = PoseTrack.load(scene_dirs)
+
+    if args.frames:
+        # Worker: render one shard into the layout prepared by the coordinator
+        frames = parse_frames(args.frames)
+        armature = setup_scene(args.glb, args.view_transform)
+        with profiling.stage('render', frames=len(frames), width=RESOLUTION[0], height=RESOLUTION[1], worker=True):
+            if args.bake:
+                bake_animation(armature, track, args.rotation)
+                render_baked(args.folder, frame_ranges(frames))
+            else:
+                render_frames(armature, track, args.folder, set(frames), rotation=args.rotation)
+        sys.exit(0)
+
+    streaming = args.stream and args.workers <= 1 and not (args.bake or args.export_animation)
+
+    def render(dirty):
+        if args.workers > 1:
+            if dirty:
+                with profiling.stage('render', frames=len(dirty), workers=args.workers):
+                    render_parallel(args, dirty, args.workers, args.retries)
+            if args.export_animation:
+                armature = setup_scene(args.glb, args.view_transform)
+                bake_animation(armature, track, args.rotation)
+                export_baked_animation(armature, args.export_animation)
+        else:
+            render_scene(lambda: setup_scene(args.glb, args.view_transform), track, args.folder, args.logo, dirty, args.bake,
+                         args.export_animation, streaming, args.write_frames, args.rotation)
+
+    render_animation(track, args.folder, args.logo, scene_settings(args.glb, args.view_transform), render,
+                     args.force, streaming, args.write_frames, args.rotation)
 
 # Remove all directories ending with '_animation'
 # current_directory = os.getcwd()
@@ -199,4 +531,3 @@ video.release()
 # if os.path.exists('rigged.glb'):
 #     os.remove('rigged.glb')
 # print(f"Removed file: glb")
-
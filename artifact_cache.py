@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# Bump when a pipeline change makes previously cached results stale
+CACHE_VERSION = 2
+
+class ArtifactCache:
+    # Content-addressed on-disk cache of NumPy arrays with a size limit and LRU eviction.
+    # Entries are .npz files named by the hash of their inputs; the file mtime is the last use.
+    def __init__(self, directory, max_bytes=2 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, kind, arrays, params):
+        # Hash the raw array contents together with every parameter that affects the result
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([CACHE_VERSION, kind, params], sort_keys=True).encode())
+        for array in arrays:
+            if array is None:
+                digest.update(b'none')
+                continue
+            array = np.ascontiguousarray(array)
+            digest.update(f'{array.dtype.str}{array.shape}'.encode())
+            # Flattened so empty arrays (zeros in the shape) can be viewed as bytes too
+            digest.update(memoryview(array.reshape(-1)).cast('B'))
+        return f'{kind}-{digest.hexdigest()}'
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path)
+        return arrays
+
+    def put(self, key, **arrays):
+        # Write to a temporary file first so a crashed worker never leaves a truncated entry behind
+        path = self.path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        # Drop the least recently used entries until the cache fits again
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
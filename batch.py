@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import glob
+import queue
+import shutil
+import argparse
+import threading
+import subprocess
+import profiling
+import glb_optimize
+
+# Fans a directory or manifest of GLBs out over N long-lived headless Blender workers (batch_worker.py),
+# so Blender startup and the cv2/sklearn imports are paid once per worker instead of once per file.
+#   python batch.py characters/ -o out/ -n 4 --mode 1 --report report.json
+
+RESULT_PREFIX = 'BATCH_RESULT '
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch_worker.py')
+
+def collect_jobs(source, output_dir, mode, brightness, cache_dir=None, cache_bytes=2 << 30, smoothing='bmesh', smoothing_options=None, optimize=None, texture_workers=None):
+    # A directory is scanned for *.glb; anything else is a manifest, either a JSON list or one path per line
+    if os.path.isdir(source):
+        inputs = sorted(glob.glob(os.path.join(source, '*.glb')))
+    elif source.endswith('.json'):
+        with open(source, 'r') as f:
+            inputs = json.load(f)
+    else:
+        with open(source, 'r') as f:
+            inputs = [line.strip() for line in f if line.strip()]
+
+    jobs = []
+    for entry in inputs:
+        # Manifest entries may carry their own output path and settings
+        job = dict(entry) if isinstance(entry, dict) else {'input': entry}
+        name = os.path.splitext(os.path.basename(job['input']))[0]
+        job.setdefault('output', os.path.join(output_dir, f'{name}_smoothed_{mode}.glb'))
+        job.setdefault('mode', mode)
+        job.setdefault('brightness', brightness)
+        job.setdefault('smoothing', smoothing)
+        job.setdefault('smoothing_options', smoothing_options or {})
+        job.setdefault('optimize', optimize)
+        job.setdefault('texture_workers', texture_workers)
+        if cache_dir:
+            job.setdefault('cache_dir', os.path.abspath(cache_dir))
+            job.setdefault('cache_bytes', cache_bytes)
+        jobs.append(job)
+    return jobs
+
+def start_worker(blender):
+    return subprocess.Popen(
+        [blender, '--background', '--factory-startup', '--python', WORKER_SCRIPT],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+
+def failed_result(job, error):
+    return {'input': job['input'], 'output': job['output'], 'ok': False, 'error': error, 'timings': {}}
+
+def send_job(worker, job, verbose):
+    worker.stdin.write(json.dumps(job) + '\n')
+    worker.stdin.flush()
+
+    # Everything Blender prints besides our result line is log output
+    for line in worker.stdout:
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+        if verbose:
+            print(line, end='')
+    return None
+
+def worker_loop(blender, jobs, results, verbose):
+    # The worker is started with the first job and restarted with the next one after a crash
+    worker = None
+    while True:
+        try:
+            job = jobs.get_nowait()
+        except queue.Empty:
+            break
+
+        result = None
+        if worker is None:
+            try:
+                worker = start_worker(blender)
+            except OSError as e:
+                # Blender could not be started; the job fails with the reason instead of taking the thread down
+                result = failed_result(job, f'could not start Blender: {e}')
+
+        if worker is not None:
+            try:
+                result = send_job(worker, job, verbose)
+            except OSError:
+                result = None
+
+            if result is None:
+                # The worker died on this file (e.g. a crash inside Blender); record it and start a fresh one next time
+                worker.kill()
+                worker.wait()
+                result = failed_result(job, f'worker exited with code {worker.returncode}')
+                worker = None
+
+        status = 'ok' if result['ok'] else 'FAILED: ' + result['error']
+        if result.get('mesh'):
+            status += f" [{result['mesh']['triangles']} triangles, {result['mesh']['vertices']} vertices]"
+        if result.get('export'):
+            status += f" [{result['export']['saved_bytes'] / 2**20:.1f} MB saved]"
+        print(f"{job['input']}: {status} ({result.get('total', 0.0):.2f}s)")
+        results.append(result)
+
+    if worker is not None:
+        worker.stdin.close()
+        worker.wait()
+
+def run_batch(jobs, workers, blender, verbose=False):
+    pending = queue.Queue()
+    for job in jobs:
+        os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+        pending.put(job)
+
+    results = []
+    threads = [threading.Thread(target=worker_loop, args=(blender, pending, results, verbose)) for _ in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # A worker thread that died on an unexpected error leaves its jobs without a result
+    while not pending.empty():
+        results.append(failed_result(pending.get_nowait(), 'not run'))
+    if len(results) != len(jobs):
+        raise RuntimeError(f'{len(jobs) - len(results)} of {len(jobs)} jobs produced no result')
+    return results
+
+def summarize(results):
+    stages = {}
+    for result in results:
+        for stage, seconds in result['timings'].items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    succeeded = sum(1 for result in results if result['ok'])
+    print(f'{succeeded}/{len(results)} files processed')
+    saved = sum(result['export']['saved_bytes'] for result in results if result.get('export'))
+    if saved:
+        print(f'  {saved / 2**20:.1f} MB saved by export optimization')
+    for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        print(f'  {stage:<10} {seconds:8.2f}s total, {seconds / max(len(results), 1):6.2f}s per file')
+    for result in results:
+        if not result['ok']:
+            print(f"  failed: {result['input']} ({result['error']})")
+    return {'succeeded': succeeded, 'failed': len(results) - succeeded, 'stage_totals': stages, 'saved_bytes': saved, 'files': results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", type=str, help="A folder of .glb files or a manifest (.json list or one path per line).")
+    parser.add_argument("-o", "--output", type=str, default="output", help="Output folder for processed GLBs.")
+    parser.add_argument("-n", "--workers", type=int, default=os.cpu_count(), help="Number of Blender worker processes.")
+    parser.add_argument("--texture-threads", type=int, help="Denoising threads per worker (default: CPU count / workers).")
+    parser.add_argument("-m", "--mode", type=int, default=1, help="1: KMean, 2: Denoise")
+    parser.add_argument("-b", "--brightness", type=float, default=1.3)
+    parser.add_argument("-s", "--smoothing", type=str, default="bmesh", choices=["bmesh", "adaptive", "modifier", "operator"])
+    parser.add_argument("--max-triangles", type=int, help="Triangle budget per GLB for adaptive smoothing.")
+    parser.add_argument("--max-vertices", type=int, help="Vertex budget per GLB for adaptive smoothing.")
+    parser.add_argument("--blender", type=str, default=os.environ.get("BLENDER", "blender"), help="Blender executable.")
+    parser.add_argument("--cache", type=str, help="Folder for the processed texture/mesh cache shared by all workers.")
+    parser.add_argument("--cache-size", type=int, default=2048, help="Cache size limit in MB.")
+    parser.add_argument("--report", type=str, help="Write the per-file results to this JSON file.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Echo Blender's output.")
+    glb_optimize.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    if not shutil.which(args.blender):
+        parser.error(f"Blender executable {args.blender!r} not found; pass --blender or set BLENDER.")
+
+    # The workers inherit the report settings and append their stages to the same file
+    profiling.start_from_args(args)
+
+    # The Blender workers run side by side, so each one gets its share of the CPUs for denoising
+    texture_workers = args.texture_threads or max((os.cpu_count() or 1) // max(args.workers, 1), 1)
+    smoothing_options = {'max_triangles': args.max_triangles, 'max_vertices': args.max_vertices} if args.smoothing == 'adaptive' else {}
+    jobs = collect_jobs(args.source, args.output, args.mode, args.brightness, args.cache, args.cache_size << 20, args.smoothing, smoothing_options,
+                        glb_optimize.options_from_args(args), texture_workers)
+    report = summarize(run_batch(jobs, args.workers, args.blender, args.verbose))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(0 if report['failed'] == 0 else 1)
@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import time
+import traceback
+import cv2
+
+# Runs inside a long-lived headless Blender started by batch.py:
+#   blender --background --factory-startup --python batch_worker.py
+# Jobs arrive as one JSON object per line on stdin, results go back on stdout behind RESULT_PREFIX.
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from smooth_spotless import reset_scene, import_obj_change_uv_texture, export_glb, stage_timer
+from artifact_cache import ArtifactCache
+import profiling
+
+RESULT_PREFIX = 'BATCH_RESULT '
+
+def run_job(job):
+    cache = ArtifactCache(job['cache_dir'], job['cache_bytes']) if job.get('cache_dir') else None
+    timings = {}
+    start = time.perf_counter()
+    if job.get('texture_workers'):
+        # OpenCV's own thread pool would otherwise use every CPU too, in every worker
+        cv2.setNumThreads(job['texture_workers'])
+    try:
+        with stage_timer(timings, 'reset'):
+            reset_scene()
+
+        if not os.path.exists(job['input']):
+            raise FileNotFoundError(job['input'])
+
+        mesh_report = import_obj_change_uv_texture(job['input'], job.get('mode', 1), job.get('brightness', 1.3), timings=timings, cache=cache,
+                                                   smoothing=job.get('smoothing', 'bmesh'), smoothing_options=job.get('smoothing_options'),
+                                                   texture_workers=job.get('texture_workers'))
+        export_report = export_glb(job['output'], timings=timings, optimize=job.get('optimize'))
+        result = {'ok': True, 'mesh': mesh_report, 'export': export_report}
+    except Exception as e:
+        result = {'ok': False, 'error': f'{type(e).__name__}: {e}', 'traceback': traceback.format_exc()}
+
+    result.update(input=job['input'], output=job['output'], timings=timings, total=time.perf_counter() - start)
+    return result
+
+def main():
+    # batch.py --profile exports the report path to the workers through the environment
+    profiling.start_from_env()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        result = run_job(json.loads(line))
+        print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import cv2
+import numpy as np
+
+# Benchmarks for the pipeline stages on synthetic inputs, with a stored baseline to compare against.
+# The CV/NumPy stages run with plain Python:
+#   python benchmarks/bench.py --sizes 512 1024 2048 --save baseline.json
+#   python benchmarks/bench.py --compare baseline.json
+# The subdivision and rigging stages need Blender:
+#   blender --background --factory-startup --python benchmarks/bench.py -- --stages subdivide rig
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from synthetic import synthetic_texture, cylinder_mesh, write_synthetic_glb, write_pose_sequence, synthetic_logo
+from texture_pipeline import ClusteringImgColor, texture_conv, uv_coverage_mask
+from glb_texture import process_glb
+from pose_track import PoseTrack
+from video_encoder import FrameEncoder
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+CPU_STAGES = ['kmeans', 'texture_conv', 'uv_mask', 'glb_texture', 'pose', 'composite']
+BLENDER_STAGES = ['subdivide', 'rig']
+
+def measure(run, setup=None, repeats=3):
+    # Best wall time of `repeats` runs, then one more run under tracemalloc for the peak traced memory
+    # (traced separately so its overhead does not skew the times)
+    times = []
+    for _ in range(repeats):
+        args = setup() if setup else ()
+        gc.collect()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'mean_seconds': sum(times) / len(times), 'peak_traced_bytes': peak}
+
+def result(timing, amount, unit):
+    return dict(timing, amount=amount, unit=unit, throughput=amount / timing['seconds'])
+
+def bench_kmeans(sizes, repeats, workdir):
+    results = {}
+    for size in sizes:
+        rgb = cv2.cvtColor(synthetic_texture(size), cv2.COLOR_BGR2RGB)
+        timing = measure(lambda: ClusteringImgColor.kmean_clustering(rgb, 10, 'fast'), repeats=repeats)
+        results[f'kmeans[{size}]'] = result(timing, size * size, 'texels')
+    return results
+
+def bench_texture_conv(sizes, repeats, workdir):
+    results = {}
+    for size in sizes:
+        texture = synthetic_texture(size)
+        for mode, name in ((1, 'kmeans'), (2, 'denoise')):
+            timing = measure(lambda: texture_conv(texture, mode), repeats=repeats)
+            results[f'texture_conv_{name}[{size}]'] = result(timing, size * size, 'texels')
+    return results
+
+def bench_uv_mask(sizes, repeats, workdir):
+    results = {}
+    positions, uvs, indices = cylinder_mesh(50000)
+    triangles = uvs[indices].copy()
+    triangles[:, :, 1] = 1.0 - triangles[:, :, 1]
+    for size in sizes:
+        timing = measure(lambda: uv_coverage_mask(triangles, (size, size)), repeats=repeats)
+        results[f'uv_mask[{size}]'] = result(timing, len(triangles), 'triangles')
+    return results
+
+def bench_glb_texture(sizes, repeats, workdir):
+    # Texture-only mode end to end: parse, decode, texture_conv, encode, write
+    results = {}
+    for size in sizes:
+        input_path = os.path.join(workdir, f'texture_{size}.glb')
+        write_synthetic_glb(input_path, 20000, size)
+        output_path = os.path.join(workdir, f'texture_{size}_out.glb')
+        timing = measure(lambda: process_glb(input_path, output_path), repeats=repeats)
+        results[f'glb_texture[{size}]'] = result(timing, size * size, 'texels')
+    return results
+
+def bench_pose(keyframes, repeats, workdir):
+    # Loading a pose sequence and computing every frame's channels and bone rotations
+    results = {}
+    for count in keyframes:
+        folder = os.path.join(workdir, f'poses_{count}')
+        scene_dirs = write_pose_sequence(folder, count)
+        for mode in ('linear', 'slerp'):
+            def run():
+                track = PoseTrack.load(scene_dirs)
+                values = track.interpolate(30)
+                track.bone_quaternions(30, mode, values)
+            timing = measure(run, repeats=repeats)
+            results[f'pose_{mode}[{count}]'] = result(timing, 30 * (count - 1), 'frames')
+    return results
+
+def bench_composite(frame_counts, repeats, workdir):
+    # composite_video: read rendered 1920x1080 PNGs, overlay the logo, encode the video
+    results = {}
+    logo_path = synthetic_logo(os.path.join(workdir, 'logo.png'))
+    frame_folder = os.path.join(workdir, 'frames')
+    os.makedirs(frame_folder, exist_ok=True)
+    for count in frame_counts:
+        paths = []
+        for i in range(count):
+            path = os.path.join(frame_folder, f'frame_{i}.png')
+            if not os.path.exists(path):
+                frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+                cv2.circle(frame, (960 + 4 * i, 540), 200, (60, 120, 220), -1)
+                cv2.imwrite(path, frame)
+            paths.append(path)
+
+        def run():
+            encoder = FrameEncoder(os.path.join(workdir, 'output.mp4'), logo_path=logo_path)
+            try:
+                for path in paths:
+                    encoder.write(cv2.imread(path))
+            finally:
+                encoder.close()
+        timing = measure(run, repeats=repeats)
+        results[f'composite[{count}]'] = result(timing, count, 'frames')
+    return results
+
+def bench_subdivide(vertex_counts, repeats, workdir):
+    from smooth_spotless import reset_scene, add_subdivision_and_recalculate_normals, smooth_meshes
+    results = {}
+    for count in vertex_counts:
+        path = os.path.join(workdir, f'mesh_{count}.glb')
+        write_synthetic_glb(path, count, 512)
+
+        def setup():
+            reset_scene()
+            bpy.ops.import_scene.gltf(filepath=path)
+            return [obj for obj in bpy.context.selected_objects if obj.type == 'MESH'],
+
+        timing = measure(lambda objects: add_subdivision_and_recalculate_normals(objects[0]), setup, repeats)
+        results[f'subdivide_operator[{count}]'] = result(timing, count, 'vertices')
+        timing = measure(lambda objects: smooth_meshes(objects, 'bmesh'), setup, repeats)
+        results[f'subdivide_bmesh[{count}]'] = result(timing, count, 'vertices')
+    return results
+
+def bench_rig(vertex_counts, repeats, workdir):
+    from smooth_spotless import reset_scene
+    from rigging import place_character, rig_character
+    results = {}
+    for count in vertex_counts:
+        path = os.path.join(workdir, f'mesh_{count}.glb')
+        write_synthetic_glb(path, count, 512)
+
+        def setup():
+            reset_scene()
+            bpy.ops.import_scene.gltf(filepath=path)
+            return place_character(bpy.context.selected_objects[0]),
+
+        timing = measure(lambda obj_mesh: rig_character(obj_mesh), setup, repeats)
+        results[f'rig_solver[{count}]'] = result(timing, count, 'vertices')
+    return results
+
+def compare(results, baseline, threshold):
+    # Print each case against the baseline; returns the cases more than `threshold` slower
+    regressions = []
+    print(f"{'case':<32} {'baseline':>10} {'now':>10} {'change':>8} {'peak MB':>9}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        peak = current['peak_traced_bytes'] / 2**20
+        if before is None:
+            print(f"{name:<32} {'-':>10} {current['seconds']:>9.3f}s {'new':>8} {peak:>9.1f}")
+            continue
+        change = current['seconds'] / before['seconds'] - 1.0
+        flag = ' SLOWER' if change > threshold else ' faster' if change < -threshold else ''
+        print(f"{name:<32} {before['seconds']:>9.3f}s {current['seconds']:>9.3f}s {change:>+7.1%} {peak:>9.1f}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def report(results):
+    print(f"{'case':<32} {'seconds':>10} {'throughput':>22} {'peak MB':>9}")
+    for name, current in results.items():
+        throughput = f"{current['throughput']:,.0f} {current['unit']}/s"
+        print(f"{name:<32} {current['seconds']:>9.3f}s {throughput:>22} {current['peak_traced_bytes'] / 2**20:>9.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", nargs="+", choices=CPU_STAGES + BLENDER_STAGES, help="Stages to run (default: every stage this Python can run).")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[512, 1024, 2048], help="Texture sizes (up to 8192).")
+    parser.add_argument("--vertices", nargs="+", type=int, default=[10000, 50000], help="Mesh vertex counts for subdivision and rigging.")
+    parser.add_argument("--keyframes", nargs="+", type=int, default=[100, 1000], help="Pose sequence lengths.")
+    parser.add_argument("--frames", nargs="+", type=int, default=[60], help="Frame counts for compositing.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case; the best is reported.")
+    parser.add_argument("--save", type=str, help="Write the results to this JSON file (e.g. a new baseline).")
+    parser.add_argument("--compare", type=str, help="Compare against a baseline JSON file written by --save.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown counted as a regression.")
+    # When run as 'blender --background --python bench.py -- ...', only parse what follows '--'
+    args = parser.parse_args(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else None)
+
+    stages = args.stages or CPU_STAGES + (BLENDER_STAGES if bpy else [])
+    skipped = [stage for stage in stages if stage in BLENDER_STAGES and bpy is None]
+    if skipped:
+        print(f"Skipping {', '.join(skipped)}: run this script inside Blender for those.")
+
+    benchmarks = {
+        'kmeans': (bench_kmeans, args.sizes),
+        'texture_conv': (bench_texture_conv, args.sizes),
+        'uv_mask': (bench_uv_mask, args.sizes),
+        'glb_texture': (bench_glb_texture, args.sizes),
+        'pose': (bench_pose, args.keyframes),
+        'composite': (bench_composite, args.frames),
+        'subdivide': (bench_subdivide, args.vertices),
+        'rig': (bench_rig, args.vertices),
+    }
+
+    workdir = tempfile.mkdtemp(prefix='glb_bench_')
+    results = {}
+    try:
+        for stage in stages:
+            if stage in skipped:
+                continue
+            function, cases = benchmarks[stage]
+            print(f"Running {stage} ...", flush=True)
+            results.update(function(cases, args.repeats, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report(results)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}" + (': ' + ', '.join(regressions) if regressions else ''))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+                                   'python': platform.python_version(), 'blender': bpy.app.version_string if bpy else None},
+                       'results': results}, f, indent=2)
+
+    sys.exit(1 if regressions else 0)
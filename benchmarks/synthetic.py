@@ -0,0 +1,94 @@
+import os
+import sys
+import cv2
+import numpy as np
+
+# Synthetic inputs for the benchmarks: noisy flat-colour textures like the generated skins the pipeline
+# cleans, character-sized cylinder meshes packed into GLBs, and scene_*_animation pose sequences.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from glb_texture import pack_glb
+from pose_track import BONE_ANGLE_KEYS
+
+def synthetic_texture(size, colors=12, block=64, noise=12.0, seed=0):
+    # Blocky regions of a few colours plus Gaussian noise, as 8-bit BGR
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, size=(colors, 3), dtype=np.uint8)
+    cells = max(size // block, 1)
+    labels = cv2.resize(rng.integers(0, colors, size=(cells, cells), dtype=np.uint8), (size, size), interpolation=cv2.INTER_NEAREST)
+    image = palette[labels].astype(np.float32) + rng.normal(0.0, noise, size=(size, size, 3)).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def cylinder_mesh(vertex_count, height=0.6, radius=0.1):
+    # Open cylinder with about vertex_count vertices, glTF y-up, standing on y=0 like the characters
+    segments = max(int(np.sqrt(vertex_count / 2)), 3)
+    rings = max(vertex_count // (segments + 1), 2)
+    v, u = np.meshgrid(np.linspace(0.0, 1.0, rings), np.linspace(0.0, 1.0, segments + 1), indexing='ij')
+    angle = u * 2 * np.pi
+    positions = np.stack([radius * np.cos(angle), v * height, radius * np.sin(angle)], axis=-1).reshape(-1, 3).astype(np.float32)
+    uvs = np.stack([u, 1.0 - v], axis=-1).reshape(-1, 2).astype(np.float32)
+
+    # Two triangles per quad of the (rings, segments + 1) grid; the seam column is duplicated for the UVs
+    row = segments + 1
+    corner = (np.arange(rings - 1)[:, None] * row + np.arange(segments)[None, :]).ravel()
+    quads = np.stack([corner, corner + row, corner + row + 1, corner + 1], axis=1)
+    indices = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]]).astype(np.uint32)
+    return positions, uvs, indices
+
+def write_synthetic_glb(filepath, vertex_count, texture_size, seed=0, normals=False):
+    # A single textured mesh, embedded PNG base colour, in the layout bpy's glTF exporter writes;
+    # normals adds the NORMAL attribute exported characters carry
+    positions, uvs, indices = cylinder_mesh(vertex_count)
+    ok, png = cv2.imencode('.png', synthetic_texture(texture_size, seed=seed))
+    if not ok:
+        raise ValueError('Could not encode the synthetic texture')
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'GLB-preprocess benchmarks'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'name': 'Character'}],
+        'meshes': [{'name': 'Character', 'primitives': [{'attributes': {'POSITION': 0, 'TEXCOORD_0': 1}, 'indices': 2, 'material': 0}]}],
+        'materials': [{'name': 'Skin', 'pbrMetallicRoughness': {'baseColorTexture': {'index': 0}}}],
+        'textures': [{'source': 0}],
+        'images': [{'bufferView': 3, 'mimeType': 'image/png'}],
+        'accessors': [
+            {'bufferView': 0, 'componentType': 5126, 'count': len(positions), 'type': 'VEC3',
+             'min': positions.min(axis=0).tolist(), 'max': positions.max(axis=0).tolist()},
+            {'bufferView': 1, 'componentType': 5126, 'count': len(uvs), 'type': 'VEC2'},
+            {'bufferView': 2, 'componentType': 5125, 'count': indices.size, 'type': 'SCALAR'},
+        ],
+        'bufferViews': [{'buffer': 0, 'target': 34962}, {'buffer': 0, 'target': 34962}, {'buffer': 0, 'target': 34963}, {'buffer': 0}],
+        'buffers': [{}],
+    }
+    view_data = [positions.tobytes(), uvs.tobytes(), indices.tobytes(), png.tobytes()]
+    if normals:
+        radial = positions * np.array([1.0, 0.0, 1.0], dtype=np.float32)
+        radial /= np.linalg.norm(radial, axis=1, keepdims=True)
+        gltf['meshes'][0]['primitives'][0]['attributes']['NORMAL'] = 3
+        gltf['accessors'].append({'bufferView': 4, 'componentType': 5126, 'count': len(radial), 'type': 'VEC3'})
+        gltf['bufferViews'].append({'buffer': 0, 'target': 34962})
+        view_data.append(radial.tobytes())
+    pack_glb(filepath, gltf, view_data)
+    return len(positions), len(indices)
+
+def write_pose_sequence(folder, keyframes, seed=0):
+    # scene_<i>_animation/1.txt keyframes with every channel animation.py reads
+    rng = np.random.default_rng(seed)
+    scene_dirs = []
+    for i in range(keyframes):
+        scene_dir = os.path.join(folder, f'scene_{i:05d}_animation')
+        os.makedirs(scene_dir, exist_ok=True)
+        values = {'x_position': rng.uniform(-0.5, 0.5), 'y_position': rng.uniform(-0.1, 0.1),
+                  'width_ratio': rng.uniform(0.9, 1.1), 'height_ratio': rng.uniform(0.9, 1.1)}
+        values.update({key: rng.uniform(-90.0, 90.0) for key in BONE_ANGLE_KEYS.values()})
+        with open(os.path.join(scene_dir, '1.txt'), 'w') as f:
+            f.writelines(f'{key}: {value}\n' for key, value in values.items())
+        scene_dirs.append(scene_dir)
+    return scene_dirs
+
+def synthetic_logo(filepath, size=(90, 240)):
+    # Coloured text on white, like the logo animation.py overlays
+    logo = np.full(size + (3,), 255, dtype=np.uint8)
+    cv2.putText(logo, 'LOGO', (10, size[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (40, 90, 200), 6)
+    cv2.imwrite(filepath, logo)
+    return filepath
@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import zlib
+import shutil
+import struct
+import argparse
+from contextlib import nullcontext
+import cv2
+import numpy as np
+
+# Export optimization: rewrites a GLB so it downloads and loads faster, without Blender.
+#  - Images with at most 256 colours (what the k-means mode leaves) become palette-indexed PNGs.
+#  - Images larger than max_size are scaled down.
+#  - Base-colour images can be re-encoded as JPEG or WebP (EXT_texture_webp).
+#  - Texture coordinates and normals are quantized (KHR_mesh_quantization) and indices use
+#    16 bits where they fit; positions stay float so skinning and bounds are untouched.
+# Blender's glTF exporter has no quantization option, so this runs on the exported file.
+#   python glb_optimize.py output_smoothed_1.glb output_small.glb --max-texture-size 2048
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from glb_texture import GLB, pack_glb, base_color_images, decode_image, encode_image
+
+IMAGE_FORMATS = ('auto', 'png', 'jpeg', 'webp')
+MIME_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.webp': 'image/webp'}
+# Mesh data in these is not in plain buffer views, so quantizing it is left alone
+COMPRESSION_EXTENSIONS = ('KHR_draco_mesh_compression', 'EXT_meshopt_compression')
+# Its compressed streams sit in the BIN chunk outside any buffer view, so the file cannot be repacked
+UNPACKABLE_EXTENSIONS = ('EXT_meshopt_compression',)
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+def encode_indexed_png(indices, palette, level=9):
+    # indices: (height, width) uint8; palette: (colors, 4) uint8 RGBA. Rows are packed at the smallest
+    # bit depth the palette allows; alpha goes into a tRNS chunk when any entry is not opaque
+    height, width = indices.shape
+    depth = next(d for d in (1, 2, 4, 8) if len(palette) <= 1 << d)
+    per_byte = 8 // depth
+    padded = np.zeros((height, -(-width // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :width] = indices
+    shifts = (8 - depth * (np.arange(per_byte) + 1)).astype(np.uint8)
+    rows = np.bitwise_or.reduce(padded.reshape(height, -1, per_byte) << shifts, axis=2).astype(np.uint8)
+    # Filter type 0 (none) on every row, as recommended for palette images
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes()
+
+    png = b'\x89PNG\r\n\x1a\n'
+    png += png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, depth, 3, 0, 0, 0))
+    png += png_chunk(b'PLTE', palette[:, :3].tobytes())
+    if (palette[:, 3] != 255).any():
+        png += png_chunk(b'tRNS', palette[:, 3].tobytes())
+    png += png_chunk(b'IDAT', zlib.compress(raw, level))
+    png += png_chunk(b'IEND', b'')
+    return png
+
+def image_palette(bgr, alpha=None, max_colors=256, sample_size=100000):
+    # (palette RGBA, index image) when the image has at most max_colors distinct colours, else None.
+    # A sample rules most photos out early; the full image is only sorted if the sample misses colours
+    packed = bgr[:, :, 0].astype(np.uint32) | bgr[:, :, 1].astype(np.uint32) << 8 | bgr[:, :, 2].astype(np.uint32) << 16
+    packed |= (alpha.astype(np.uint32) if alpha is not None else np.uint32(255)) << 24
+    flat = packed.ravel()
+
+    colors = np.unique(flat[::max(len(flat) // sample_size, 1)])
+    if len(colors) > max_colors:
+        return None
+    indices = np.minimum(np.searchsorted(colors, flat), len(colors) - 1)
+    if not np.array_equal(colors[indices], flat):
+        colors = np.unique(flat)
+        if len(colors) > max_colors:
+            return None
+        indices = np.searchsorted(colors, flat)
+
+    palette = np.stack([colors >> 16, colors >> 8, colors, colors >> 24], axis=1).astype(np.uint8)
+    return palette, indices.reshape(packed.shape).astype(np.uint8)
+
+def fit_size(shape, max_size):
+    height, width = shape[:2]
+    scale = max_size / max(height, width) if max_size else 1.0
+    if scale >= 1.0:
+        return None
+    return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
+
+def optimize_image(data, mime_type, max_size=None, image_format='auto', quality=90, lossy_allowed=True):
+    # Returns (bytes, mime type, description), or None to keep the original bytes
+    bgr, alpha = decode_image(data)
+    if alpha is not None and (alpha == 255).all():
+        alpha = None
+    size = fit_size(bgr.shape, max_size)
+
+    lossy = image_format in ('jpeg', 'webp') and lossy_allowed and not (image_format == 'jpeg' and alpha is not None)
+    if not lossy and image_format != 'png':
+        found = image_palette(bgr, alpha)
+        if found is not None:
+            palette, indices = found
+            if size:
+                indices = cv2.resize(indices, size, interpolation=cv2.INTER_NEAREST)
+            encoded = encode_indexed_png(indices, palette)
+            if size or len(encoded) < len(data):
+                return encoded, 'image/png', f'palette PNG, {len(palette)} colours'
+            return None
+
+    if size:
+        bgr = cv2.resize(bgr, size, interpolation=cv2.INTER_AREA)
+        alpha = cv2.resize(alpha, size, interpolation=cv2.INTER_AREA) if alpha is not None else None
+
+    if lossy:
+        extension = '.jpg' if image_format == 'jpeg' else '.webp'
+        flag = cv2.IMWRITE_JPEG_QUALITY if extension == '.jpg' else cv2.IMWRITE_WEBP_QUALITY
+        image = np.dstack([bgr, alpha]) if alpha is not None else bgr
+        ok, encoded = cv2.imencode(extension, image, [flag, quality])
+        if not ok:
+            raise ValueError(f'Could not encode image as {extension}')
+        return encoded.tobytes(), MIME_TYPES[extension], f'{image_format} q{quality}'
+
+    if size or image_format == 'png':
+        encoded = encode_image(bgr, alpha, '.png')
+        if size or len(encoded) < len(data) or mime_type != 'image/png':
+            return encoded, 'image/png', 'PNG'
+    return None
+
+def quantize_accessor(glb, index, semantic):
+    # (bytes, componentType, byteStride) for the quantized accessor, or None to leave it as it is
+    accessor = glb.gltf['accessors'][index]
+    if 'sparse' in accessor or 'bufferView' not in accessor or accessor['componentType'] != 5126:
+        return None
+    values = glb.accessor(index)
+    if semantic.startswith('TEXCOORD_'):
+        # Unsigned 16-bit normalized covers [0, 1] at 1/65535, a fraction of a texel even at 8192
+        if values.min() < 0.0 or values.max() > 1.0:
+            return None
+        return np.round(values * 65535.0).astype(np.uint16).tobytes(), 5123, None
+    if semantic == 'NORMAL':
+        # Signed 8-bit normalized, padded to 4 bytes per vertex as vertex attributes require
+        normals = np.zeros((len(values), 4), dtype=np.int8)
+        normals[:, :3] = np.round(np.clip(values, -1.0, 1.0) * 127.0).astype(np.int8)
+        return normals.tobytes(), 5120, 4
+    return None
+
+def use_extension(gltf, name, required=False):
+    if name not in gltf.setdefault('extensionsUsed', []):
+        gltf['extensionsUsed'].append(name)
+    if required and name not in gltf.setdefault('extensionsRequired', []):
+        gltf['extensionsRequired'].append(name)
+
+def quantize_meshes(glb, gltf, view_data):
+    # Rewrites accessors in gltf to new buffer views appended to view_data; returns how many changed
+    changed = 0
+    done = set()
+    for mesh in gltf.get('meshes', []):
+        for primitive in mesh['primitives']:
+            targets = [(semantic, index) for semantic, index in primitive['attributes'].items()]
+            if 'indices' in primitive:
+                targets.append(('INDICES', primitive['indices']))
+            for semantic, index in targets:
+                if index in done:
+                    continue
+                done.add(index)
+                accessor = gltf['accessors'][index]
+
+                if semantic == 'INDICES':
+                    if accessor['componentType'] != 5125 or 'sparse' in accessor or 'bufferView' not in accessor:
+                        continue
+                    indices = glb.accessor(index)[:, 0]
+                    if len(indices) and indices.max() >= 65535:
+                        continue
+                    quantized = (indices.astype(np.uint16).tobytes(), 5123, None)
+                    target, normalized = 34963, False
+                else:
+                    quantized = quantize_accessor(glb, index, semantic)
+                    target, normalized = 34962, True
+                if quantized is None:
+                    continue
+
+                data, component_type, stride = quantized
+                view = {'buffer': 0, 'byteLength': len(data), 'target': target}
+                if stride:
+                    view['byteStride'] = stride
+                gltf['bufferViews'].append(view)
+                view_data.append(data)
+                accessor['bufferView'] = len(gltf['bufferViews']) - 1
+                accessor.pop('byteOffset', None)
+                accessor['componentType'] = component_type
+                if normalized:
+                    accessor['normalized'] = True
+                    use_extension(gltf, 'KHR_mesh_quantization', required=True)
+                changed += 1
+    return changed
+
+def extension_view_users(gltf):
+    # Objects inside 'extensions' that point at a buffer view, e.g. the KHR_draco_mesh_compression entry of a primitive
+    users = []
+    def visit(node, in_extension):
+        if isinstance(node, dict):
+            if in_extension and isinstance(node.get('bufferView'), int):
+                users.append(node)
+            for key, value in node.items():
+                visit(value, in_extension or key == 'extensions')
+        elif isinstance(node, list):
+            for value in node:
+                visit(value, in_extension)
+    visit(gltf, False)
+    return users
+
+def drop_unused_views(gltf, view_data):
+    # Remove buffer views nothing refers to any more and renumber the references
+    extension_users = extension_view_users(gltf)
+    used = set(user['bufferView'] for user in extension_users)
+    for accessor in gltf.get('accessors', []):
+        if 'bufferView' in accessor:
+            used.add(accessor['bufferView'])
+        for part in ('indices', 'values'):
+            if 'sparse' in accessor:
+                used.add(accessor['sparse'][part]['bufferView'])
+    used.update(image['bufferView'] for image in gltf.get('images', []) if 'bufferView' in image)
+
+    keep = [index for index in range(len(gltf['bufferViews'])) if index in used or view_data[index] is None]
+    renumber = {old: new for new, old in enumerate(keep)}
+    gltf['bufferViews'] = [gltf['bufferViews'][index] for index in keep]
+    view_data[:] = [view_data[index] for index in keep]
+
+    for accessor in gltf.get('accessors', []):
+        if 'bufferView' in accessor:
+            accessor['bufferView'] = renumber[accessor['bufferView']]
+        if 'sparse' in accessor:
+            for part in ('indices', 'values'):
+                accessor['sparse'][part]['bufferView'] = renumber[accessor['sparse'][part]['bufferView']]
+    for image in gltf.get('images', []):
+        if 'bufferView' in image:
+            image['bufferView'] = renumber[image['bufferView']]
+    for user in extension_users:
+        user['bufferView'] = renumber[user['bufferView']]
+
+def optimize_glb(input_path, output_path, max_size=None, image_format='auto', quality=90, quantize=True):
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f'Unknown image format {image_format!r}; expected one of {", ".join(IMAGE_FORMATS)}')
+
+    report = {'input_bytes': os.path.getsize(input_path), 'images': [], 'quantized_accessors': 0}
+    temp_path = output_path + '.tmp'
+    with GLB(input_path) as glb:
+        gltf = json.loads(json.dumps(glb.gltf))
+        unpackable = [name for name in UNPACKABLE_EXTENSIONS if name in gltf.get('extensionsUsed', [])]
+        if unpackable:
+            print(f"{input_path}: uses {', '.join(unpackable)}, left unchanged")
+            if os.path.abspath(input_path) != os.path.abspath(output_path):
+                shutil.copyfile(input_path, output_path)
+            return dict(report, output_bytes=report['input_bytes'], saved_bytes=0)
+        if any(name in gltf.get('extensionsUsed', []) for name in COMPRESSION_EXTENSIONS):
+            quantize = False
+        view_data = [glb.buffer_view(index) if view['buffer'] == 0 else None for index, view in enumerate(gltf.get('bufferViews', []))]
+
+        # Only base-colour images may go lossy; normal and metallic-roughness maps stay exact
+        base_colors = set(base_color_images(gltf))
+        for image_index, image in enumerate(gltf.get('images', [])):
+            if 'bufferView' not in image:
+                continue
+            before = len(view_data[image['bufferView']])
+            optimized = optimize_image(view_data[image['bufferView']], image.get('mimeType'), max_size, image_format, quality, image_index in base_colors)
+            if optimized is None:
+                continue
+            data, mime_type, description = optimized
+            view_data[image['bufferView']] = data
+            image['mimeType'] = mime_type
+            report['images'].append({'image': image_index, 'before': before, 'after': len(data), 'encoding': description})
+            print(f'Image {image_index}: {before} -> {len(data)} bytes ({description})')
+
+            if mime_type == 'image/webp':
+                # WebP textures are only allowed through EXT_texture_webp
+                for texture in gltf.get('textures', []):
+                    if texture.get('source') == image_index:
+                        texture.setdefault('extensions', {})['EXT_texture_webp'] = {'source': image_index}
+                        del texture['source']
+                use_extension(gltf, 'EXT_texture_webp', required=True)
+
+        if quantize:
+            report['quantized_accessors'] = quantize_meshes(glb, gltf, view_data)
+
+        drop_unused_views(gltf, view_data)
+        pack_glb(temp_path, gltf, view_data)
+        # Release the views into the memory map before it is closed
+        view_data.clear()
+    os.replace(temp_path, output_path)
+
+    report['output_bytes'] = os.path.getsize(output_path)
+    report['saved_bytes'] = report['input_bytes'] - report['output_bytes']
+    print(f"{output_path}: {report['input_bytes']} -> {report['output_bytes']} bytes "
+          f"({report['saved_bytes'] / max(report['input_bytes'], 1):.0%} saved, {report['quantized_accessors']} accessors quantized)")
+    return report
+
+def optimized_export(export, filepath, options, timer=None):
+    # Run export(path) to a temporary GLB and optimize it into filepath; options as given by options_from_args.
+    # timer() is an optional context manager around the optimization alone, e.g. a stage timer
+    raw_path = os.path.splitext(filepath)[0] + '.unoptimized.glb'
+    export(raw_path)
+    try:
+        with timer() if timer else nullcontext():
+            return optimize_glb(raw_path, filepath, **options)
+    finally:
+        os.remove(raw_path)
+
+def add_arguments(parser, switch=True):
+    # switch: add --optimize itself, for scripts where the optimization is optional
+    if switch:
+        parser.add_argument("--optimize", action="store_true", help="Optimize the exported GLB (palette PNGs, texture size limit, quantized attributes).")
+    parser.add_argument("--max-texture-size", type=int, help="With --optimize, scale textures down to at most this many pixels per side.")
+    parser.add_argument("--image-format", type=str, default="auto", choices=IMAGE_FORMATS, help="With --optimize, base-colour image encoding.")
+    parser.add_argument("--quality", type=int, default=90, help="With --optimize, JPEG/WebP quality.")
+    parser.add_argument("--no-quantize", action="store_true", help="With --optimize, keep float texture coordinates and normals.")
+
+def options_from_args(args):
+    if not args.optimize:
+        return None
+    return {'max_size': args.max_texture_size, 'image_format': args.image_format, 'quality': args.quality, 'quantize': not args.no_quantize}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=str, help="The glb file to optimize.")
+    parser.add_argument("output", type=str, help="Where to write the optimized glb (may be the input).")
+    add_arguments(parser, switch=False)
+    args = parser.parse_args()
+    args.optimize = True
+
+    optimize_glb(args.input, args.output, **options_from_args(args))
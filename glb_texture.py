@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+import cv2
+import numpy as np
+
+# Texture-only mode: cleans the base-color textures of a GLB without Blender.
+# The GLB is parsed directly (JSON + memory-mapped BIN chunk), the images referenced by the
+# materials go through the same texture_conv as smooth_spotless.py, and a new GLB is written
+# in which only the image buffer views are replaced.
+#   python glb_texture.py final.glb output_texture_1.glb --mode 1
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from texture_pipeline import texture_conv, uv_coverage_mask
+from artifact_cache import ArtifactCache
+
+GLB_MAGIC = 0x46546C67  # 'glTF'
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+COMPONENT_DTYPES = {5120: np.int8, 5121: np.uint8, 5122: np.int16, 5123: np.uint16, 5125: np.uint32, 5126: np.float32}
+TYPE_SIZES = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+IMAGE_EXTENSIONS = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/webp': '.webp'}
+
+class GLB:
+    # A GLB opened for reading: the parsed JSON plus a memory-mapped view of the BIN chunk
+    def __init__(self, filepath):
+        self.file = open(filepath, 'rb')
+        self.mmap = None
+        try:
+            if os.fstat(self.file.fileno()).st_size < 12:
+                raise ValueError(f'{filepath} is not a glTF 2.0 binary file')
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.read_chunks(filepath)
+        except BaseException:
+            # Not a GLB (or truncated): do not leave the file and the map open behind the error
+            self.close()
+            raise
+
+    def read_chunks(self, filepath):
+        magic, version, length = struct.unpack_from('<III', self.mmap, 0)
+        if magic != GLB_MAGIC or version != 2:
+            raise ValueError(f'{filepath} is not a glTF 2.0 binary file')
+
+        self.gltf = None
+        self.bin_offset = self.bin_length = 0
+        offset = 12
+        while offset < length:
+            chunk_length, chunk_type = struct.unpack_from('<II', self.mmap, offset)
+            if chunk_type == CHUNK_JSON:
+                self.gltf = json.loads(self.mmap[offset + 8:offset + 8 + chunk_length])
+            elif chunk_type == CHUNK_BIN:
+                self.bin_offset, self.bin_length = offset + 8, chunk_length
+            offset += 8 + chunk_length
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def buffer_view(self, index):
+        # Zero-copy view of an embedded buffer view
+        view = self.gltf['bufferViews'][index]
+        if view['buffer'] != 0 or 'uri' in self.gltf['buffers'][0]:
+            raise ValueError('Only buffer views of the embedded BIN chunk can be read')
+        start = self.bin_offset + view.get('byteOffset', 0)
+        return memoryview(self.mmap)[start:start + view['byteLength']]
+
+    def accessor(self, index):
+        # Read an accessor into an (count, components) float array, honouring byteStride and normalization
+        accessor = self.gltf['accessors'][index]
+        dtype = np.dtype(COMPONENT_DTYPES[accessor['componentType']])
+        components = TYPE_SIZES[accessor['type']]
+        count = accessor['count']
+        if 'bufferView' not in accessor:
+            return np.zeros((count, components), dtype=np.float32)
+
+        view = self.gltf['bufferViews'][accessor['bufferView']]
+        stride = view.get('byteStride', dtype.itemsize * components)
+        data = np.ndarray((count, components), dtype=dtype, buffer=self.buffer_view(accessor['bufferView']),
+                          offset=accessor.get('byteOffset', 0), strides=(stride, dtype.itemsize))
+
+        values = data.astype(np.float32)
+        if accessor.get('normalized') and dtype.kind in 'iu':
+            values /= np.iinfo(dtype).max
+        return values
+
+def base_color_images(gltf):
+    # Map each image used as a base color to the (material index, texCoord set) pairs using it
+    images = {}
+    for material_index, material in enumerate(gltf.get('materials', [])):
+        texture_info = material.get('pbrMetallicRoughness', {}).get('baseColorTexture')
+        if texture_info is None:
+            continue
+        texture = gltf['textures'][texture_info['index']]
+        if 'source' in texture:
+            images.setdefault(texture['source'], []).append((material_index, texture_info.get('texCoord', 0)))
+    return images
+
+def image_uv_triangles(glb, users):
+    # UV triangles of every primitive drawn with one of the given materials, in Blender's v-up convention
+    tex_coords = dict(users)
+    triangles = []
+    for mesh in glb.gltf.get('meshes', []):
+        for primitive in mesh['primitives']:
+            tex_coord = tex_coords.get(primitive.get('material'))
+            attribute = f'TEXCOORD_{tex_coord}'
+            if tex_coord is None or primitive.get('mode', 4) != 4 or attribute not in primitive['attributes']:
+                continue
+
+            uvs = glb.accessor(primitive['attributes'][attribute])
+            uvs[:, 1] = 1.0 - uvs[:, 1]
+            if 'indices' in primitive:
+                indices = glb.accessor(primitive['indices'])[:, 0].astype(np.int64)
+            else:
+                indices = np.arange(len(uvs))
+            triangles.append(uvs[indices[:len(indices) // 3 * 3]].reshape(-1, 3, 2))
+
+    if not triangles:
+        return np.empty((0, 3, 2), dtype=np.float32)
+    return np.concatenate(triangles)
+
+def decode_image(data):
+    # Decode to 8-bit BGR plus an optional alpha channel, like cv2.imread gives the Blender path
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError('Could not decode image')
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR), None
+    if image.shape[2] == 4:
+        return np.ascontiguousarray(image[:, :, :3]), image[:, :, 3]
+    return image, None
+
+def encode_image(bgr, alpha, extension):
+    if alpha is not None and extension != '.jpg':
+        bgr = np.dstack([bgr, alpha])
+    ok, encoded = cv2.imencode(extension, bgr)
+    if not ok:
+        raise ValueError(f'Could not encode image as {extension}')
+    return encoded.tobytes()
+
+def pack_glb(filepath, gltf, view_data):
+    # Write gltf (modified in place) as a GLB whose BIN chunk holds view_data[i] for every buffer view i
+    # of buffer 0, re-packed with 4-byte alignment; views of other buffers have None
+    pieces = []
+    offset = 0
+    for view, data in zip(gltf.get('bufferViews', []), view_data):
+        if data is None:
+            continue
+        padding = -offset % 4
+        if padding:
+            pieces.append(b'\0' * padding)
+            offset += padding
+        view['byteOffset'] = offset
+        view['byteLength'] = len(data)
+        pieces.append(data)
+        offset += len(data)
+
+    bin_length = offset + (-offset % 4)
+    if gltf.get('buffers'):
+        gltf['buffers'][0]['byteLength'] = offset
+
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode()
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    total_length = 12 + 8 + len(json_chunk) + (8 + bin_length if pieces else 0)
+
+    with open(filepath, 'wb') as f:
+        f.write(struct.pack('<III', GLB_MAGIC, 2, total_length))
+        f.write(struct.pack('<II', len(json_chunk), CHUNK_JSON))
+        f.write(json_chunk)
+        if pieces:
+            f.write(struct.pack('<II', bin_length, CHUNK_BIN))
+            for piece in pieces:
+                f.write(piece)
+            f.write(b'\0' * (bin_length - offset))
+    return total_length
+
+def write_glb(filepath, glb, replacements):
+    # Write a new GLB where the buffer views listed in replacements get new bytes and all other
+    # embedded views are copied straight from the memory map
+    gltf = json.loads(json.dumps(glb.gltf))
+    view_data = [None if view['buffer'] != 0 else replacements[index] if index in replacements else glb.buffer_view(index)
+                 for index, view in enumerate(gltf.get('bufferViews', []))]
+    return pack_glb(filepath, gltf, view_data)
+
+def process_glb(input_path, output_path, mode = 1, brightness = 1.3, use_uv_mask = True, cache = None):
+    with GLB(input_path) as glb:
+        replacements = {}
+        for image_index, users in base_color_images(glb.gltf).items():
+            image_info = glb.gltf['images'][image_index]
+            if 'bufferView' not in image_info:
+                print(f'Image {image_index} is not embedded in the GLB; skipped.')
+                continue
+
+            texture_image, texture_alpha = decode_image(glb.buffer_view(image_info['bufferView']))
+
+            # Only filter the texels covered by the UV islands of the primitives using this image
+            mask = uv_coverage_mask(image_uv_triangles(glb, users), texture_image.shape) if use_uv_mask else None
+
+            _, modified_texture = texture_conv(texture_image, mode, brightness, mask=mask, cache=cache)
+            extension = IMAGE_EXTENSIONS.get(image_info.get('mimeType'), '.png')
+            replacements[image_info['bufferView']] = encode_image(modified_texture, texture_alpha, extension)
+            print(f'Base Color image {image_index} updated ({len(users)} material(s))')
+
+        return write_glb(output_path, glb, replacements)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=str, help="The glb file to process.")
+    parser.add_argument("output", type=str, help="Where to write the processed glb.")
+    parser.add_argument("-m", "--mode", type=int, default=1, help="1: KMean, 2: Denoise")
+    parser.add_argument("-b", "--brightness", type=float, default=1.3)
+    parser.add_argument("--no-uv-mask", action="store_true", help="Filter the whole texture, not only the texels the UVs cover.")
+    parser.add_argument("--cache", type=str, help="Folder for the processed texture cache.")
+    args = parser.parse_args()
+
+    cache = ArtifactCache(args.cache) if args.cache else None
+
+    process_glb(args.input, args.output, args.mode, args.brightness, not args.no_uv_mask, cache)
@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import argparse
+
+# Runs smoothing, rigging and animation in one Blender session on the in-memory scene, instead of
+# exporting output_smoothed_*.glb and rigged.glb only for the next script to import them again.
+# Only the final artifacts are written, plus the intermediate GLBs when --checkpoints is given.
+#   blender --background --python pipeline.py -- -g final.glb -f . -l logo.png --mode 1
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import bpy
+from smooth_spotless import stage_timer, smooth_and_retexture, apply_modifiers, export_glb
+from rigging import BONE_TABLE, load_bone_table, place_character, rig_character, export_rigged
+from animation import (PoseTrack, ROTATION_MODES, find_scene_dirs, wait_for_inputs, setup_scene,
+                       scene_settings, render_scene, render_animation)
+from artifact_cache import ArtifactCache
+import profiling
+import glb_optimize
+
+def smooth_stage(glb_path, mode=1, brightness=1.3, smoothing='bmesh', smoothing_options=None, cache=None, timings=None):
+    with stage_timer(timings, 'import'):
+        bpy.ops.import_scene.gltf(filepath=glb_path)
+    mesh_objects = [obj for obj in bpy.context.selected_objects if obj.type == 'MESH']
+    mesh_report = smooth_and_retexture(mesh_objects, mode, brightness, timings=timings, cache=cache,
+                                       smoothing=smoothing, smoothing_options=smoothing_options)
+    print(f"Smoothed {len(mesh_objects)} mesh(es): {mesh_report['triangles']} triangles, {mesh_report['vertices']} vertices")
+    return mesh_objects
+
+def rig_stage(mesh_objects, bones=BONE_TABLE, weights='solver'):
+    # The exported GLB had its modifiers applied, so apply them here too before weighting the vertices
+    apply_modifiers(mesh_objects)
+    obj_mesh = place_character(mesh_objects[0])
+    return rig_character(obj_mesh, bones, weights)
+
+def animate_stage(track, folder, logo_path, settings, bake=False, export_animation=None, stream=False,
+                  write_frames=False, rotation='linear', force=False, view_transform=None):
+    # The rigged armature is already in the scene; setup_scene only adds the light and render settings
+    streaming = stream and not (bake or export_animation)
+    def render(dirty):
+        render_scene(lambda: setup_scene(view_transform=view_transform), track, folder, logo_path, dirty, bake, export_animation, streaming, write_frames, rotation)
+
+    render_animation(track, folder, logo_path, settings, render, force, streaming, write_frames, rotation)
+
+def run_pipeline(args, timings):
+    bones = load_bone_table(args.bones) if args.bones else BONE_TABLE
+    smoothing_options = {'max_triangles': args.max_triangles, 'max_vertices': args.max_vertices} if args.smoothing == 'adaptive' else {}
+    cache = ArtifactCache(args.cache) if args.cache else None
+    if args.checkpoints:
+        os.makedirs(args.checkpoints, exist_ok=True)
+
+    with stage_timer(timings, 'smooth'):
+        mesh_objects = smooth_stage(args.glb, args.mode, args.brightness, args.smoothing, smoothing_options, cache, timings)
+    if args.checkpoints:
+        with stage_timer(timings, 'checkpoint'):
+            export_glb(os.path.join(args.checkpoints, f'output_smoothed_{args.mode}.glb'))
+
+    with stage_timer(timings, 'rig'):
+        rig_stage(mesh_objects, bones, args.weights)
+    if args.rigged_output:
+        # The rigged character is a final artifact, so it gets the export optimization if asked for
+        with stage_timer(timings, 'export'):
+            optimize = glb_optimize.options_from_args(args)
+            if optimize:
+                glb_optimize.optimized_export(export_rigged, args.rigged_output, optimize)
+            else:
+                export_rigged(args.rigged_output)
+    elif args.checkpoints:
+        with stage_timer(timings, 'checkpoint'):
+            export_rigged(os.path.join(args.checkpoints, 'rigged.glb'))
+
+    with stage_timer(timings, 'animate'):
+        track = PoseTrack.load(find_scene_dirs(os.getcwd()))
+        # Frames are keyed on the input GLB plus everything the earlier stages did to it
+        settings = scene_settings(args.glb, args.view_transform, mode=args.mode, brightness=args.brightness,
+                                  smoothing=args.smoothing, smoothing_options=smoothing_options, bones=bones, weights=args.weights)
+        animate_stage(track, args.folder, args.logo, settings, args.bake, args.export_animation, args.stream,
+                      args.write_frames, args.rotation, args.force, args.view_transform)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--glb", type=str, help="The character glb file.")
+    parser.add_argument("-f", "--folder", type=str, default=".", help="Output folder for scene/ (frames and video).")
+    parser.add_argument("-l", "--logo", type=str, help="The logo png file.")
+    parser.add_argument("-m", "--mode", type=int, default=1, help="1: KMean, 2: Denoise")
+    parser.add_argument("-b", "--brightness", type=float, default=1.3)
+    parser.add_argument("-s", "--smoothing", type=str, default="bmesh", choices=["bmesh", "adaptive", "modifier", "operator"])
+    parser.add_argument("--max-triangles", type=int, help="Triangle budget for adaptive smoothing.")
+    parser.add_argument("--max-vertices", type=int, help="Vertex budget for adaptive smoothing.")
+    parser.add_argument("--cache", type=str, help="Folder for the processed texture/mesh cache.")
+    parser.add_argument("--bones", type=str, help="JSON bone table to use instead of the built-in skeleton.")
+    parser.add_argument("-w", "--weights", type=str, default="solver", choices=["solver", "heat", "compare"])
+    parser.add_argument("--rigged-output", type=str, help="Also export the rigged character to this GLB.")
+    parser.add_argument("--checkpoints", type=str, help="Export the smoothed and rigged GLBs into this folder.")
+    parser.add_argument("--bake", action="store_true", help="Bake the poses into keyframes and render them with one animation render.")
+    parser.add_argument("--export-animation", type=str, help="Also export the baked action as a glTF animation to this GLB.")
+    parser.add_argument("--stream", action="store_true", help="Encode the video straight from the render result instead of re-reading PNGs (needs --view-transform Standard).")
+    parser.add_argument("--write-frames", action="store_true", help="With --stream, still write scene/frame_<i>/frame.png.")
+    parser.add_argument("--rotation", type=str, default="linear", choices=ROTATION_MODES)
+    parser.add_argument("--force", action="store_true", help="Re-render every frame instead of only the changed ones.")
+    parser.add_argument("--view-transform", type=str, help="Color management view transform, e.g. Standard (default: the scene's, Filmic/AgX).")
+    parser.add_argument("--wait-timeout", type=float, help="Give up if the GLB and scene folders are not complete after this many seconds.")
+    parser.add_argument("--report", type=str, help="Write the per-stage timings to this JSON file.")
+    glb_optimize.add_arguments(parser)
+    profiling.add_arguments(parser)
+    # When run as 'blender --background --python pipeline.py -- ...', only parse what follows '--'
+    args = parser.parse_args(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else None)
+    if args.stream and args.view_transform != 'Standard':
+        parser.error("--stream encodes the render result without tone mapping; pass --view-transform Standard with it")
+    profiling.start_from_args(args)
+
+    wait_for_inputs(args.glb, os.getcwd(), timeout=args.wait_timeout)
+
+    timings = {}
+    run_pipeline(args, timings)
+
+    # smooth, rig, checkpoint, export and animate add up to the total; import, subdivide and texture are parts of smooth
+    for stage, seconds in timings.items():
+        print(f'  {stage:<10} {seconds:8.2f}s')
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(timings, f, indent=2)
@@ -0,0 +1,129 @@
+import os
+import numpy as np
+
+# Pose keyframes (one scene_*_animation/1.txt each) held as a keyframes x channels array, with every
+# in-between frame and every bone quaternion computed in one vectorized pass. Needs no bpy.
+
+# Pose-data key driving each bone's angle
+BONE_ANGLE_KEYS = {
+    'Arm.R': 'RightShoulder',
+    'Arm.L': 'LeftShoulder',
+    'Leg.R': 'RHipJoint',
+    'Leg.L': 'LHipJoint',
+    'Hand.R': 'RightArm',
+    'Hand.L': 'LeftArm',
+    'Foot.R': 'RightLeg',
+    'Foot.L': 'LeftLeg',
+}
+
+# How each bone's angle becomes its (w, x, y, z) rotation: w is 1 and
+# quaternion[component] = scale * sin(angle + phase) + offset
+BONE_ROTATIONS = {
+    'Arm.R': (1, 1 / 1.7, 0, 0),
+    'Arm.L': (1, 1 / 1.7, 0, 0),
+    'Leg.R': (3, 1, 90, -0.25),
+    'Leg.L': (3, 1, 90, 0.25),
+    'Hand.R': (1, -1, 0, 0),
+    'Hand.L': (1, 1, 0, 0),
+    'Foot.R': (3, -1, 0, 0),
+    'Foot.L': (3, -1, 0, 0),
+}
+
+ROTATION_MODES = ('linear', 'normalized', 'slerp')
+
+def read_bone_data(file_path):
+    data = {}
+    with open(file_path, 'r') as f:
+        for line in f:
+            key, value = line.split(':')
+            data[key.strip()] = float(value.strip())
+    return data
+
+def angle_quaternions(bone_name, angles):
+    # Quaternions for an array of angles in degrees, as rows of (w, x, y, z)
+    component, scale, phase, offset = BONE_ROTATIONS[bone_name]
+    quaternions = np.zeros((len(angles), 4))
+    quaternions[:, 0] = 1.0
+    quaternions[:, component] = scale * np.sin(np.radians(angles + phase)) + offset
+    return quaternions
+
+def normalize(quaternions):
+    return quaternions / np.linalg.norm(quaternions, axis=-1, keepdims=True)
+
+def slerp(start, end, factor):
+    # Row-wise spherical interpolation between unit quaternions, along the shorter arc
+    dot = np.sum(start * end, axis=-1, keepdims=True)
+    end = np.where(dot < 0.0, -end, end)
+    dot = np.clip(np.abs(dot), 0.0, 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+
+    # Nearly identical rotations fall back to a normalized lerp
+    close = sin_theta < 1e-6
+    safe = np.where(close, 1.0, sin_theta)
+    weight_start = np.where(close, 1.0 - factor, np.sin((1.0 - factor) * theta) / safe)
+    weight_end = np.where(close, factor, np.sin(factor * theta) / safe)
+    return normalize(weight_start * start + weight_end * end)
+
+class PoseTrack:
+    def __init__(self, channels, keys):
+        # channels: names in column order; keys: (keyframes, channels) float64 array
+        self.channels = list(channels)
+        self.index = {name: i for i, name in enumerate(self.channels)}
+        self.keys = np.asarray(keys, dtype=np.float64)
+
+    @classmethod
+    def load(cls, scene_dirs):
+        # Scenes without a 1.txt are left out, like the old per-pair isfile check did
+        keyframes = []
+        for scene_dir in scene_dirs:
+            file_path = os.path.join(scene_dir, "1.txt")
+            if os.path.isfile(file_path):
+                keyframes.append(read_bone_data(file_path))
+            else:
+                print(f"{file_path} not found; scene skipped.")
+
+        channels = list(keyframes[0]) if keyframes else []
+        keys = np.array([[data[name] for name in channels] for data in keyframes], dtype=np.float64).reshape(len(keyframes), len(channels))
+        return cls(channels, keys)
+
+    def frame_count(self, frames_per_scene):
+        return frames_per_scene * max(len(self.keys) - 1, 0)
+
+    def segments(self, frames_per_scene):
+        # Start keyframe and interpolation factor of every frame
+        frames = np.arange(self.frame_count(frames_per_scene))
+        return frames // frames_per_scene, (frames % frames_per_scene) / float(frames_per_scene)
+
+    def interpolate(self, frames_per_scene):
+        # (frames, channels) array: linear interpolation between consecutive keyframes
+        segment, factor = self.segments(frames_per_scene)
+        start = self.keys[segment]
+        return start + (self.keys[segment + 1] - start) * factor[:, None]
+
+    def column(self, values, name):
+        return values[:, self.index[name]]
+
+    def bone_quaternions(self, frames_per_scene, mode='linear', values=None):
+        # bone name -> (frames, 4) quaternions for every bone whose angle key is in the track.
+        # 'linear' builds them from the interpolated angles as the renderer always did, 'normalized'
+        # scales those to unit length, 'slerp' interpolates the keyframe rotations on the unit sphere
+        if mode not in ROTATION_MODES:
+            raise ValueError(f'Unknown rotation mode {mode!r}; expected one of {", ".join(ROTATION_MODES)}')
+
+        quaternions = {}
+        if mode == 'slerp':
+            segment, factor = self.segments(frames_per_scene)
+            for bone_name, key in BONE_ANGLE_KEYS.items():
+                if key in self.index:
+                    keyed = normalize(angle_quaternions(bone_name, self.keys[:, self.index[key]]))
+                    quaternions[bone_name] = slerp(keyed[segment], keyed[segment + 1], factor[:, None])
+            return quaternions
+
+        if values is None:
+            values = self.interpolate(frames_per_scene)
+        for bone_name, key in BONE_ANGLE_KEYS.items():
+            if key in self.index:
+                rotation = angle_quaternions(bone_name, self.column(values, key))
+                quaternions[bone_name] = normalize(rotation) if mode == 'normalized' else rotation
+        return quaternions
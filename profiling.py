@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Stage instrumentation shared by smooth_spotless.py, rigging.py, animation.py and the texture pipeline.
+# Every named stage records its wall time, its peak traced (Python/NumPy) memory, the process' peak RSS
+# and input sizes such as texture resolution or vertex counts, as one JSON line per stage in the run report.
+# Optionally each stage is also run under cProfile and dumped to <profile_dir>/<pid>_<n>_<stage>.prof.
+# Nothing is measured until start() is called, so instrumented code costs nothing otherwise.
+# The settings are exported as environment variables, so Blender worker processes report into the same file.
+
+REPORT_ENV = 'GLB_PROFILE_REPORT'
+PROFILE_DIR_ENV = 'GLB_PROFILE_DIR'
+MEMORY_ENV = 'GLB_PROFILE_MEMORY'
+
+PROFILER = None
+
+class Profiler:
+    def __init__(self, report_path, profile_dir=None, trace_memory=True, run=None):
+        self.report_path = report_path
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.run = run or uuid.uuid4().hex[:12]
+        self.stack = []
+        self.count = 0
+        self.finished = False
+        self.start_time = time.perf_counter()
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.write({'event': 'start', 'argv': sys.argv, 'python': sys.version.split()[0]})
+
+    def write(self, record):
+        # Appended one line at a time, so parallel workers can share a report and a crash keeps what was measured
+        record = dict(record, run=self.run, pid=os.getpid(), time=time.time())
+        with open(self.report_path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    @contextmanager
+    def stage(self, name, **sizes):
+        frame = {'name': name, 'sizes': dict(sizes), 'peak': 0, 'profile': None}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The enclosing stage keeps the peak seen so far; this stage starts from a fresh one
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['base'] = current
+        # Only one cProfile can be active at a time; nested stages show up in the outer stage's dump
+        if self.profile_dir and not any(f['profile'] for f in self.stack):
+            frame['profile'] = cProfile.Profile()
+            frame['profile'].enable()
+
+        self.stack.append(frame)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield frame['sizes']
+        except BaseException as e:
+            error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.stack.pop()
+            path = '/'.join([f['name'] for f in self.stack] + [name])
+            record = {'event': 'stage', 'stage': name, 'path': path, 'seconds': seconds, 'sizes': frame['sizes']}
+
+            if frame['profile']:
+                frame['profile'].disable()
+                self.count += 1
+                dump_path = os.path.join(self.profile_dir, f'{os.getpid()}_{self.count:03d}_{path.replace("/", "-")}.prof')
+                frame['profile'].dump_stats(dump_path)
+                record['profile'] = dump_path
+            if self.trace_memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                if self.stack:
+                    self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+                record['peak_traced_bytes'] = max(peak - frame['base'], 0)
+            if resource:
+                # ru_maxrss is in kB on Linux and in bytes on macOS
+                max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                record['max_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+            if error:
+                record['error'] = error
+            self.write(record)
+
+    def annotate(self, **sizes):
+        # Attach input sizes to the innermost running stage, for sizes only known once it has started
+        if self.stack:
+            self.stack[-1]['sizes'].update(sizes)
+
+    def finish(self):
+        # Also registered with atexit, so only the first call writes the end record
+        if self.finished:
+            return
+        self.finished = True
+        self.write({'event': 'end', 'seconds': time.perf_counter() - self.start_time})
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+def start(report_path, profile_dir=None, trace_memory=True, run=None):
+    # Start recording for this process and every process it launches
+    global PROFILER
+    if PROFILER is not None:
+        return PROFILER
+    report_path = os.path.abspath(report_path)
+    os.environ[REPORT_ENV] = report_path
+    if profile_dir:
+        profile_dir = os.path.abspath(profile_dir)
+        os.environ[PROFILE_DIR_ENV] = profile_dir
+    os.environ[MEMORY_ENV] = '1' if trace_memory else '0'
+
+    PROFILER = Profiler(report_path, profile_dir, trace_memory, run)
+    atexit.register(PROFILER.finish)
+    return PROFILER
+
+def start_from_env():
+    # Used by scripts without their own flags and by worker processes started by an instrumented parent
+    if os.environ.get(REPORT_ENV):
+        return start(os.environ[REPORT_ENV], os.environ.get(PROFILE_DIR_ENV), os.environ.get(MEMORY_ENV, '1') != '0')
+    return None
+
+@contextmanager
+def stage(name, **sizes):
+    # Measure a named stage if profiling was started; yields the dict of recorded sizes
+    if PROFILER is None:
+        yield dict(sizes)
+    else:
+        with PROFILER.stage(name, **sizes) as recorded:
+            yield recorded
+
+def annotate(**sizes):
+    if PROFILER is not None:
+        PROFILER.annotate(**sizes)
+
+def add_arguments(parser):
+    parser.add_argument("--profile", type=str, help="Append per-stage timings, peak memory and input sizes to this JSONL report.")
+    parser.add_argument("--profile-dir", type=str, help="With --profile, also dump a cProfile .prof file per stage into this folder.")
+    parser.add_argument("--no-trace-memory", action="store_true", help="With --profile, skip tracemalloc (it slows allocation-heavy code).")
+
+def start_from_args(args):
+    # --profile on the command line, otherwise whatever an instrumented parent process set up
+    if args.profile:
+        return start(args.profile, args.profile_dir, not args.no_trace_memory)
+    return start_from_env()
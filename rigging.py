@@ -1,104 +1,287 @@
 import bpy
+import bmesh
 from math import radians
 import argparse
+import json
+import os
 import sys
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
 
-def create_bone(name, head, tail, roll):
+# Blender does not put the script folder on sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import profiling
+
+# Skeleton as data: bone name, head, tail, roll (degrees) and parent bone.
+# A JSON file with the same list of objects can be passed with --bones for other character proportions.
+BONE_TABLE = [
+    {'name': 'Body', 'head': (0, 0, 0.23), 'tail': (0, 0, 0.43), 'roll': 0, 'parent': None},
+    {'name': 'Head', 'head': (0, 0, 0.45), 'tail': (0, 0, 0.6), 'roll': 0, 'parent': 'Body'},
+    {'name': 'Leg.L', 'head': (0.04, 0, 0.22), 'tail': (0.06, 0, 0.11), 'roll': 0, 'parent': 'Body'},
+    {'name': 'Foot.L', 'head': (0.06, 0, 0.11), 'tail': (0.08, 0, 0), 'roll': 0, 'parent': 'Leg.L'},
+    {'name': 'Arm.L', 'head': (0.04, 0, 0.4), 'tail': (0.16, 0, 0.4), 'roll': 0, 'parent': 'Body'},
+    {'name': 'Hand.L', 'head': (0.16, 0, 0.4), 'tail': (0.28, 0, 0.4), 'roll': 0, 'parent': 'Arm.L'},
+    {'name': 'Leg.R', 'head': (-0.04, 0, 0.22), 'tail': (-0.06, 0, 0.11), 'roll': 0, 'parent': 'Body'},
+    {'name': 'Foot.R', 'head': (-0.06, 0, 0.11), 'tail': (-0.08, 0, 0), 'roll': 0, 'parent': 'Leg.R'},
+    {'name': 'Arm.R', 'head': (-0.04, 0, 0.4), 'tail': (-0.16, 0, 0.4), 'roll': 0, 'parent': 'Body'},
+    {'name': 'Hand.R', 'head': (-0.16, 0, 0.4), 'tail': (-0.28, 0, 0.4), 'roll': 0, 'parent': 'Arm.R'},
+]
+
+def load_bone_table(filepath):
+    with open(filepath, 'r') as f:
+        bones = json.load(f)
+
+    names = set()
+    for bone in bones:
+        for key in ('name', 'head', 'tail'):
+            if key not in bone:
+                raise ValueError(f'Bone entry {bone} in {filepath} has no "{key}"')
+        if bone.get('parent') and bone['parent'] not in names:
+            raise ValueError(f'Bone "{bone["name"]}" in {filepath} is listed before its parent "{bone["parent"]}"')
+        names.add(bone['name'])
+    return bones
+
+def import_character(glb_path):
+    bpy.ops.import_scene.gltf(filepath=glb_path)
+    return place_character(bpy.context.selected_objects[0])
+
+def place_character(obj_mesh):
+    # Scale, orient and lift the character mesh into the skeleton's frame
+    obj_mesh.scale = (0.5, 0.5, 0.5)
+
+    bpy.ops.object.select_all(action='DESELECT')
+    obj_mesh.select_set(True)
+    bpy.context.view_layer.objects.active = obj_mesh
+    bpy.ops.object.transform_apply(location=True, scale=True, rotation=True)
+    obj_mesh.rotation_euler = (radians(90), 0, radians(90))
+    obj_mesh.location = (0, 0, 0.35)
+    return obj_mesh
+
+def close_vertex_pairs(co, distance):
+    # All pairs (i, j), i < j, of vertices closer than distance. SciPy is installed into Blender's
+    # Python with scikit-learn (which depends on it) for the texture stage
+    return cKDTree(co).query_pairs(distance, output_type='ndarray')
+
+def weld_vertices(obj_mesh, distance=0.0001):
+    # Merge by distance like bpy.ops.mesh.remove_doubles, on the vertex array instead of through edit mode
+    mesh = obj_mesh.data
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    pairs = close_vertex_pairs(co.reshape(-1, 3), distance)
+    if len(pairs) == 0:
+        return 0
+
+    # Point every vertex of a cluster at its lowest index, propagating until the clusters are stable
+    targets = np.arange(len(mesh.vertices))
+    while True:
+        previous = targets.copy()
+        np.minimum.at(targets, pairs[:, 1], targets[pairs[:, 0]])
+        np.minimum.at(targets, pairs[:, 0], targets[pairs[:, 1]])
+        targets = targets[targets]
+        if np.array_equal(previous, targets):
+            break
+
+    merged = np.flatnonzero(targets != np.arange(len(targets)))
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    bm.verts.ensure_lookup_table()
+    bmesh.ops.weld_verts(bm, targetmap={bm.verts[i]: bm.verts[targets[i]] for i in merged})
+    bm.to_mesh(mesh)
+    bm.free()
+    mesh.update()
+
+    print(f'Removed {len(merged)} vertices')
+    return len(merged)
+
+def create_armature(name='Armature'):
+    # Build the armature through the data API; unlike armature_add it starts without a default bone
+    armature = bpy.data.objects.new(name, bpy.data.armatures.new(name))
+    bpy.context.scene.collection.objects.link(armature)
+    return armature
+
+def build_skeleton(armature, bones):
+    # Create and parent every bone of the table in a single edit session
+    bpy.ops.object.select_all(action='DESELECT')
+    armature.select_set(True)
+    bpy.context.view_layer.objects.active = armature
     bpy.ops.object.mode_set(mode='EDIT')
-    armature = bpy.context.object
-    bone = armature.data.edit_bones.new(name)
-    bone.head = head
-    bone.tail = tail
-    bone.roll = radians(roll)
+
+    edit_bones = armature.data.edit_bones
+    for bone in bones:
+        edit_bone = edit_bones.new(bone['name'])
+        edit_bone.head = bone['head']
+        edit_bone.tail = bone['tail']
+        edit_bone.roll = radians(bone.get('roll', 0))
+        if bone.get('parent'):
+            edit_bone.parent = edit_bones[bone['parent']]
+
     bpy.ops.object.mode_set(mode='OBJECT')
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-g", "--glb", type=str, help="The glb file path.")
-args = parser.parse_args()
+def point_segment_distances(points, heads, tails, chunk_size=65536):
+    # Distance from every point (V, 3) to every bone segment (B, 3)-(B, 3), as a (V, B) array.
+    # The (chunk, B, 3) temporaries are built per block of vertices so a subdivided mesh with
+    # millions of vertices does not need gigabytes for them
+    segments = tails - heads
+    lengths_squared = np.maximum((segments * segments).sum(axis=1), 1e-12)
+    distances = np.empty((len(points), len(heads)), dtype=np.float32)
+    for start in range(0, len(points), chunk_size):
+        offsets = points[start:start + chunk_size, None, :] - heads[None, :, :]
+        t = np.clip((offsets * segments[None, :, :]).sum(axis=2) / lengths_squared, 0.0, 1.0)
+        offsets -= t[:, :, None] * segments[None, :, :]
+        distances[start:start + chunk_size] = np.linalg.norm(offsets, axis=2)
+    return distances
+
+def smooth_weights(weights, edges, iterations=2, factor=0.5):
+    # Blend each vertex's weights with the average of its neighbours over the mesh adjacency
+    n = len(weights)
+    adjacency = coo_matrix((np.ones(2 * len(edges), dtype=np.float32), (np.concatenate([edges[:, 0], edges[:, 1]]), np.concatenate([edges[:, 1], edges[:, 0]]))), shape=(n, n)).tocsr()
+    degree = np.asarray(adjacency.sum(axis=1)).reshape(-1, 1)
+
+    isolated = degree[:, 0] == 0
+    degree[isolated] = 1.0
+    for _ in range(iterations):
+        average = (adjacency @ weights) / degree
+        average[isolated] = weights[isolated]
+        weights = (1.0 - factor) * weights + factor * average
+    return weights
+
+def compute_bone_weights(points, heads, tails, falloff=4.0, max_influences=4, edges=None, smooth_iterations=2):
+    # Inverse-distance weights to the bone segments, sharpened by falloff
+    distances = point_segment_distances(points, heads, tails)
+    weights = 1.0 / np.power(distances + 1e-4, falloff)
+
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    if edges is not None and smooth_iterations > 0:
+        weights = smooth_weights(weights, edges, smooth_iterations)
 
-glb_path = args.glb
-bpy.ops.import_scene.gltf(filepath=glb_path)
+    # Keep the strongest bones per vertex (glTF skins carry 4 joints per vertex) and normalize
+    if max_influences < weights.shape[1]:
+        weakest = np.argpartition(weights, -max_influences, axis=1)[:, :-max_influences]
+        np.put_along_axis(weights, weakest, 0.0, axis=1)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return weights
 
-imported_objects = bpy.context.selected_objects
+def write_vertex_groups(obj_mesh, bone_names, weights, levels=256):
+    # VertexGroup.add takes one weight per call, so quantize the weights and add every vertex
+    # sharing a level at once: at most `levels` calls per bone instead of one per vertex.
+    # One stable sort per bone groups the vertices by level, in vertex order within each level
+    quantized = np.round(weights * (levels - 1)).astype(np.int32)
+    for bone_index, bone_name in enumerate(bone_names):
+        group = obj_mesh.vertex_groups.get(bone_name) or obj_mesh.vertex_groups.new(name=bone_name)
+        column = quantized[:, bone_index]
+        order = np.argsort(column, kind='stable')
+        present, starts = np.unique(column[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for level, start, end in zip(present, starts, ends):
+            if level > 0:
+                group.add(order[start:end].tolist(), level / (levels - 1), 'REPLACE')
 
-obj_mesh = bpy.context.selected_objects[0]
-obj_mesh.scale = (0.5, 0.5, 0.5)
+def solve_weights(obj_mesh, armature, falloff=4.0, smooth_iterations=2):
+    mesh = obj_mesh.data
 
-bpy.context.view_layer.objects.active = obj_mesh
-bpy.ops.object.transform_apply(location=True, scale=True, rotation=True)
-obj_mesh.rotation_euler = (radians(90), 0, radians(90))
-obj_mesh.location = (0, 0, 0.35)
+    # Vertices and bones in world space
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    matrix = np.array(obj_mesh.matrix_world, dtype=np.float32)
+    points = co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
 
-bpy.ops.object.mode_set(mode='OBJECT')
+    bones = armature.data.bones
+    heads = np.array([armature.matrix_world @ bone.head_local for bone in bones], dtype=np.float32)
+    tails = np.array([armature.matrix_world @ bone.tail_local for bone in bones], dtype=np.float32)
 
-bpy.context.view_layer.objects.active = obj_mesh
-obj_mesh.select_set(True)
+    edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges)
 
-bpy.ops.object.mode_set(mode='EDIT')
+    weights = compute_bone_weights(points, heads, tails, falloff, edges=edges.reshape(-1, 2), smooth_iterations=smooth_iterations)
+    write_vertex_groups(obj_mesh, [bone.name for bone in bones], weights)
 
-bpy.ops.mesh.remove_doubles()
+def parent_to_armature(obj_mesh, armature):
+    # What parent_set(type='ARMATURE_NAME') does, without the operator
+    obj_mesh.parent = armature
+    obj_mesh.matrix_parent_inverse = armature.matrix_world.inverted()
+    modifier = obj_mesh.modifiers.new('Armature', 'ARMATURE')
+    modifier.object = armature
 
-bpy.ops.object.mode_set(mode='OBJECT')
+def unbind_mesh(obj_mesh):
+    obj_mesh.vertex_groups.clear()
+    for modifier in [m for m in obj_mesh.modifiers if m.type == 'ARMATURE']:
+        obj_mesh.modifiers.remove(modifier)
+    matrix = obj_mesh.matrix_world.copy()
+    obj_mesh.parent = None
+    obj_mesh.matrix_world = matrix
 
-bpy.ops.object.armature_add(enter_editmode=True, location=(0, 0, 0))
-armature = bpy.context.object
+def bind_mesh(obj_mesh, armature, weights='solver'):
+    # weights 'solver' uses the distance-based solver above; 'heat' runs Blender's bone-heat weighting;
+    # 'compare' times both on this mesh and keeps the solver result
+    if weights == 'compare':
+        start = time.perf_counter()
+        bind_mesh(obj_mesh, armature, 'heat')
+        heat_seconds = time.perf_counter() - start
+        unbind_mesh(obj_mesh)
 
-create_bone('Body', (0, 0, 0.23), (0, 0, 0.43), 0)
-create_bone('Head', (0, 0, 0.45), (0, 0, 0.6), 0)
-create_bone('Leg.L', (0.04, 0, 0.22), (0.06, 0, 0.11), 0)
-create_bone('Foot.L', (0.06, 0, 0.11), (0.08, 0, 0), 0)
-create_bone('Arm.L', (0.04, 0, 0.4), (0.16, 0, 0.4), 0)
-create_bone('Hand.L', (0.16, 0, 0.4), (0.28, 0, 0.4), 0)
-create_bone('Leg.R', (-0.04, 0, 0.22), (-0.06, 0, 0.11), 0)
-create_bone('Foot.R', (-0.06, 0, 0.11), (-0.08, 0, 0), 0)
-create_bone('Arm.R', (-0.04, 0, 0.4), (-0.16, 0, 0.4), 0)
-create_bone('Hand.R', (-0.16, 0, 0.4), (-0.28, 0, 0.4), 0)
+        start = time.perf_counter()
+        bind_mesh(obj_mesh, armature, 'solver')
+        solver_seconds = time.perf_counter() - start
+        print(f'Skin weights for {len(obj_mesh.data.vertices)} vertices: heat {heat_seconds:.2f}s, solver {solver_seconds:.2f}s')
+        return
 
-bpy.ops.object.mode_set(mode='EDIT')
-body_bone = armature.data.edit_bones['Body']
-head_bone = armature.data.edit_bones['Head']
-head_bone.parent = body_bone
+    if weights == 'solver':
+        solve_weights(obj_mesh, armature)
+        parent_to_armature(obj_mesh, armature)
+        return
 
-leg_l_bone = armature.data.edit_bones['Leg.L']
-leg_l_bone.parent = body_bone
-foot_l_bone = armature.data.edit_bones['Foot.L']
-foot_l_bone.parent = leg_l_bone
+    bpy.ops.object.select_all(action='DESELECT')
+    obj_mesh.select_set(True)
+    armature.select_set(True)
 
-arm_l_bone = armature.data.edit_bones['Arm.L']
-arm_l_bone.parent = body_bone
-hand_l_bone = armature.data.edit_bones['Hand.L']
-hand_l_bone.parent = arm_l_bone
+    bpy.context.view_layer.objects.active = armature
 
-leg_r_bone = armature.data.edit_bones['Leg.R']
-leg_r_bone.parent = body_bone
-foot_r_bone = armature.data.edit_bones['Foot.R']
-foot_r_bone.parent = leg_r_bone
+    bpy.ops.object.parent_set(type='ARMATURE_AUTO')
+    armature.select_set(False)
+    # bpy.ops.object.parent_set(type='ARMATURE_ENVELOPE')
 
-arm_r_bone = armature.data.edit_bones['Arm.R']
-arm_r_bone.parent = body_bone
-hand_r_bone = armature.data.edit_bones['Hand.R']
-hand_r_bone.parent = arm_r_bone
+def rig_character(obj_mesh, bones=BONE_TABLE, weights='solver'):
+    mesh = obj_mesh.data
+    with profiling.stage('weld', vertices=len(mesh.vertices), faces=len(mesh.polygons)):
+        weld_vertices(obj_mesh)
 
-bpy.ops.object.mode_set(mode='OBJECT')
+    with profiling.stage('skeleton', bones=len(bones)):
+        armature = create_armature()
+        build_skeleton(armature, bones)
+    with profiling.stage('weights', method=weights, vertices=len(mesh.vertices), faces=len(mesh.polygons), bones=len(bones)):
+        bind_mesh(obj_mesh, armature, weights)
 
-bpy.ops.object.select_all(action='DESELECT')
-obj_mesh.select_set(True)
-armature.select_set(True)
+    for obj in bpy.data.objects:
+        if obj.type == 'MESH' and obj != obj_mesh:
+            bpy.data.objects.remove(obj)
 
-bpy.context.view_layer.objects.active = armature
+    armature.location = (0, 0, 0)
+    return armature
 
-bpy.ops.object.parent_set(type='ARMATURE_AUTO')
-armature.select_set(False)
-# bpy.ops.object.parent_set(type='ARMATURE_ENVELOPE')
+def export_rigged(glb_out_path):
+    bpy.ops.export_scene.gltf(
+        filepath=glb_out_path,
+        export_format='GLB',
+    )
 
-for obj in bpy.data.objects:
-    if obj.type == 'MESH' and obj != obj_mesh:
-        bpy.data.objects.remove(obj)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--glb", type=str, help="The glb file path.")
+    parser.add_argument("-b", "--bones", type=str, help="JSON bone table to use instead of the built-in skeleton.")
+    parser.add_argument("-w", "--weights", type=str, default="solver", choices=["solver", "heat", "compare"], help="Skin weight method; 'compare' times both.")
+    parser.add_argument("-o", "--output", type=str, default="./rigged.glb", help="The rigged glb file path.")
+    profiling.add_arguments(parser)
+    # When run as 'blender --background --python rigging.py -- -g file.glb', only parse what follows '--'
+    args = parser.parse_args(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else None)
 
-armature.location = (0, 0, 0)
+    profiling.start_from_args(args)
+    bones = load_bone_table(args.bones) if args.bones else BONE_TABLE
 
-glb_out_path = "./rigged.glb"
-bpy.ops.export_scene.gltf(
-    filepath=glb_out_path,
-    export_format='GLB',
-)
+    with profiling.stage('import', file_bytes=os.path.getsize(args.glb)):
+        obj_mesh = import_character(args.glb)
+    rig_character(obj_mesh, bones, args.weights)
+    with profiling.stage('export'):
+        export_rigged(args.output)
@@ -1,75 +1,126 @@
 import bpy
+import bmesh
 import os
-import cv2 # "C:\Program Files\Blender Foundation\Blender <version>\python\bin\python.exe" -m pip install opencv-python
+import sys
+import time
+from math import radians
+from contextlib import contextmanager
 import numpy as np
-from sklearn.cluster import KMeans
 
-class ClusteringImgColor:    
-    def convert_rgb_to_hsv(image):
-        # Convert from RGB to HSV using OpenCV
-        return cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+# Blender does not put the script folder on sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from texture_pipeline import texture_conv, uv_coverage_mask
+import profiling
+from glb_optimize import optimized_export
 
-    def cluster_pixels(image, n_clusters=5):
-        # Reshape the image to a 2D array of pixels
-        pixels = image.reshape(-1, 3).astype(np.float32)
-        
-        # Create and fit the KMeans model
-        kmeans = KMeans(n_clusters=n_clusters, random_state=0).fit(pixels)
-        
-        # Get the cluster centers (mean colors)
-        cluster_centers = kmeans.cluster_centers_.astype(np.uint8)
-        
-        # Predict the cluster for each pixel
-        labels = kmeans.predict(pixels)
+def del_existing_objs():
+    # Clear any existing objects
+    bpy.ops.object.select_all(action='DESELECT')
+    bpy.ops.object.select_all(action='SELECT')
+    bpy.ops.object.delete()
         
-        return labels, cluster_centers
+def reset_scene():
+    # Remove every object without going through operators, then purge the meshes,
+    # materials and images they leave behind so long-lived workers do not grow
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
 
-    def apply_kmeans_to_image(labels, cluster_centers, image_shape):
-        # Map each pixel to its cluster center color
-        new_pixels = np.array([cluster_centers[label] for label in labels], dtype=np.uint8)
-        
-        # Reshape the result back to the original image shape
-        new_image = new_pixels.reshape(image_shape)
-        
-        return new_image
+@contextmanager
+def stage_timer(timings, stage):
+    # Accumulate the wall time of a named stage into timings, if given; the stage is also
+    # recorded by the profiler when one is running
+    start = time.perf_counter()
+    try:
+        with profiling.stage(stage):
+            yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
 
-    def convert_hsv_to_rgb(image):
-        # Convert from HSV to RGB using OpenCV
-        return cv2.cvtColor(image, cv2.COLOR_HSV2RGB)
+def mesh_to_arrays(mesh):
+    # Pull the geometry, UV maps, material indices, smooth flags and sharp edges out with foreach_get
+    def read(collection, attribute, dtype, width=1):
+        values = np.empty(len(collection) * width, dtype=dtype)
+        collection.foreach_get(attribute, values)
+        return values
 
-    def kmean_clustering(image, n_clusters):
-        # Convert RGB to HSV
-        hsv_image = ClusteringImgColor.convert_rgb_to_hsv(image)
-        
-        # Cluster the pixels in the HSV color space
-        labels, cluster_centers = ClusteringImgColor.cluster_pixels(hsv_image, n_clusters=n_clusters)  # Adjust number of clusters as needed
-        
-        # Apply the K-Means result to the image
-        clustered_hsv_image = ClusteringImgColor.apply_kmeans_to_image(labels, cluster_centers, hsv_image.shape)
-        
-        # Convert the clustered HSV image back to RGB
-        clustered_rgb_image = ClusteringImgColor.convert_hsv_to_rgb(clustered_hsv_image)
-        
-        # Convert RGB back to BGR for OpenCV
-        clustered_bgr_image = cv2.cvtColor(clustered_rgb_image, cv2.COLOR_RGB2BGR)
+    arrays = {
+        'co': read(mesh.vertices, 'co', np.float32, 3),
+        'vertex_index': read(mesh.loops, 'vertex_index', np.int32),
+        'loop_start': read(mesh.polygons, 'loop_start', np.int32),
+        'loop_total': read(mesh.polygons, 'loop_total', np.int32),
+        'material_index': read(mesh.polygons, 'material_index', np.int32),
+        'use_smooth': read(mesh.polygons, 'use_smooth', bool),
+        'uv_names': np.array([layer.name for layer in mesh.uv_layers], dtype=str),
+    }
+    # Edges are rebuilt from the faces in a different order, so sharp edges are kept as vertex pairs
+    edges = read(mesh.edges, 'vertices', np.int32, 2).reshape(-1, 2)
+    arrays['sharp_edges'] = np.sort(edges[read(mesh.edges, 'use_edge_sharp', bool)], axis=1)
+    for i, layer in enumerate(mesh.uv_layers):
+        arrays[f'uv_{i}'] = read(layer.data, 'uv', np.float32, 2)
+    return arrays
 
-        return clustered_rgb_image, clustered_bgr_image
-    
-def kMean_Img(original_img_path, labeled_texture_map, n_cluster=10):
-    original_img = cv2.imread(original_img_path)
-    original_img_rgb = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
-    clustered_rgb_image, clustered_bgr_image = ClusteringImgColor.kmean_clustering(original_img_rgb, n_cluster)
+# Attributes mesh_to_arrays stores or arrays_to_mesh rebuilds; names starting with '.' are Blender's internal
+# selection/hide state and are not exported
+CACHED_ATTRIBUTES = {'position', 'material_index', 'sharp_face', 'sharp_edge'}
 
-    cv2.imwrite(labeled_texture_map, clustered_bgr_image)
-    return labeled_texture_map, clustered_bgr_image
+def clear_custom_normals(objects):
+    # The glTF importer turns every NORMAL attribute into custom split normals. Smoothing shades the
+    # subdivided surface with recomputed normals instead, and without the custom layer the mesh is cacheable
+    for obj in objects:
+        if obj.data.has_custom_normals:
+            with bpy.context.temp_override(active_object=obj, object=obj, selected_objects=[obj], selected_editable_objects=[obj]):
+                bpy.ops.mesh.customdata_custom_splitnormals_clear()
+
+def mesh_cacheable(mesh):
+    # Color attributes, custom split normals and other edge flags (creases, seams) are not in the cached
+    # arrays, so a mesh carrying any of them is always subdivided instead of rebuilt from the cache
+    if mesh.has_custom_normals or len(mesh.color_attributes):
+        return False
+    known = CACHED_ATTRIBUTES | {layer.name for layer in mesh.uv_layers}
+    return all(attribute.name.startswith('.') or attribute.name in known for attribute in mesh.attributes)
+
+def arrays_to_mesh(mesh, arrays):
+    # Rebuild the mesh in place from mesh_to_arrays output; materials stay assigned
+    mesh.clear_geometry()
+    mesh.vertices.add(len(arrays['co']) // 3)
+    mesh.vertices.foreach_set('co', arrays['co'])
+    mesh.loops.add(len(arrays['vertex_index']))
+    mesh.loops.foreach_set('vertex_index', arrays['vertex_index'])
+    mesh.polygons.add(len(arrays['loop_start']))
+    mesh.polygons.foreach_set('loop_start', arrays['loop_start'])
+    # loop_total is derived from loop_start (and read-only) since Blender 4.0
+    if not bpy.types.MeshPolygon.bl_rna.properties['loop_total'].is_readonly:
+        mesh.polygons.foreach_set('loop_total', arrays['loop_total'])
+    mesh.polygons.foreach_set('material_index', arrays['material_index'])
+    mesh.polygons.foreach_set('use_smooth', arrays['use_smooth'])
+
+    for i, name in enumerate(arrays['uv_names']):
+        mesh.uv_layers.new(name=str(name)).data.foreach_set('uv', arrays[f'uv_{i}'])
+
+    mesh.update(calc_edges=True)
+
+    if len(arrays['sharp_edges']):
+        edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+        mesh.edges.foreach_get('vertices', edges)
+        edges = np.sort(edges.reshape(-1, 2), axis=1).astype(np.int64)
+        sharp = arrays['sharp_edges'].astype(np.int64)
+        count = len(mesh.vertices)
+        mesh.edges.foreach_set('use_edge_sharp', np.isin(edges[:, 0] * count + edges[:, 1], sharp[:, 0] * count + sharp[:, 1]))
+
+def add_subdivision_and_recalculate_normals(obj, cache=None):
+    # The same input mesh always subdivides to the same result, so reuse it when cached
+    if cache is not None and not mesh_cacheable(obj.data):
+        cache = None
+    if cache is not None:
+        cache_key = cache.key('mesh', list(mesh_to_arrays(obj.data).values()), dict(number_cuts=2))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f'Mesh cache hit: {cache_key}')
+            arrays_to_mesh(obj.data, cached)
+            return
 
-def del_existing_objs():
-    # Clear any existing objects
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.ops.object.select_all(action='SELECT')
-    bpy.ops.object.delete()
-        
-def add_subdivision_and_recalculate_normals(obj):
     bpy.context.view_layer.objects.active = obj
 
     # Enter Edit Mode to recalculate normals
@@ -86,6 +137,139 @@ def add_subdivision_and_recalculate_normals(obj):
     
     # Switch back to Object Mode
     bpy.ops.object.mode_set(mode='OBJECT')
+
+    if cache is not None:
+        cache.put(cache_key, **mesh_to_arrays(obj.data))
+
+def smooth_meshes(objects, method='bmesh', number_cuts=2, levels=1, cache=None, max_edge_length=None, max_angle=radians(30), max_triangles=None, max_vertices=None):
+    # method 'operator' runs the edit-mode operators object by object; 'bmesh' does the same cuts on the
+    # mesh data of every mesh in one pass without mode switches; 'adaptive' only cuts long or sharply
+    # bent edges until a triangle/vertex budget is reached; 'modifier' adds a Subdivision Surface
+    # modifier that export_glb evaluates once instead of cutting the mesh here
+    clear_custom_normals(objects)
+    if method == 'operator':
+        for obj in objects:
+            add_subdivision_and_recalculate_normals(obj, cache)
+        return report_mesh_counts(objects)
+
+    # Linked duplicates share their mesh, so handle each mesh datablock once
+    meshes = {obj.data.name: obj.data for obj in objects}
+
+    # The budget covers the whole file; each mesh gets a share proportional to its current size
+    total_triangles, total_vertices = [max(count, 1) for count in mesh_counts(meshes.values())]
+
+    for mesh in meshes.values():
+        if method == 'modifier':
+            # No cuts; the modifier does the subdivision at export
+            subdivide_mesh_bmesh(mesh, 0)
+            continue
+
+        if method == 'adaptive':
+            triangles, vertices = mesh_counts([mesh])
+            options = dict(max_edge_length=max_edge_length, max_angle=max_angle,
+                           max_triangles=max_triangles and max_triangles * triangles // total_triangles,
+                           max_vertices=max_vertices and max_vertices * vertices // total_vertices)
+        else:
+            options = dict(number_cuts=number_cuts)
+
+        mesh_cache = cache if cache is not None and mesh_cacheable(mesh) else None
+        if mesh_cache is not None:
+            cache_key = mesh_cache.key('mesh', list(mesh_to_arrays(mesh).values()), dict(method=method, **options))
+            cached = mesh_cache.get(cache_key)
+            if cached is not None:
+                print(f'Mesh cache hit: {cache_key}')
+                arrays_to_mesh(mesh, cached)
+                continue
+
+        if method == 'adaptive':
+            subdivide_mesh_adaptive(mesh, **options)
+        else:
+            subdivide_mesh_bmesh(mesh, number_cuts)
+
+        if mesh_cache is not None:
+            mesh_cache.put(cache_key, **mesh_to_arrays(mesh))
+
+    if method == 'modifier':
+        for obj in objects:
+            modifier = obj.modifiers.new('Subdivision', 'SUBSURF')
+            modifier.levels = levels
+            modifier.render_levels = levels
+
+    return report_mesh_counts(objects)
+
+def mesh_counts(meshes):
+    # Total triangle and vertex counts of the given meshes
+    triangles = vertices = 0
+    for mesh in meshes:
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get('loop_total', loop_totals)
+        triangles += int((loop_totals - 2).sum())
+        vertices += len(mesh.vertices)
+    return triangles, vertices
+
+def report_mesh_counts(objects):
+    triangles, vertices = mesh_counts({obj.data.name: obj.data for obj in objects}.values())
+    print(f'Smoothed meshes: {triangles} triangles, {vertices} vertices')
+    return {'triangles': triangles, 'vertices': vertices}
+
+def subdivide_mesh_bmesh(mesh, number_cuts=2):
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+
+    # Subdivide all faces, as the edit-mode subdivide operator does with everything selected
+    if number_cuts > 0:
+        bmesh.ops.subdivide_edges(bm, edges=bm.edges[:], cuts=number_cuts, use_grid_fill=True)
+
+    # Recalculate normals outside
+    bmesh.ops.recalc_face_normals(bm, faces=bm.faces[:])
+
+    bm.to_mesh(mesh)
+    bm.free()
+    shade_smooth(mesh)
+
+def subdivide_mesh_adaptive(mesh, max_edge_length=None, max_angle=radians(30), max_triangles=None, max_vertices=None, max_passes=4):
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+
+    # By default an edge is "long" when it is 1.5x the median edge of the input mesh
+    if max_edge_length is None:
+        max_edge_length = 1.5 * float(np.median([edge.calc_length() for edge in bm.edges])) if bm.edges else 0.0
+
+    for _ in range(max_passes):
+        edges = bm.edges[:]
+        lengths = np.fromiter((edge.calc_length() for edge in edges), dtype=np.float64, count=len(edges))
+        angles = np.fromiter((edge.calc_face_angle(0.0) for edge in edges), dtype=np.float64, count=len(edges))
+        candidates = np.flatnonzero((lengths > max_edge_length) | (angles > max_angle))
+        if len(candidates) == 0:
+            break
+
+        # Each cut edge adds at most 3 triangles and 1.5 vertices (with the grid-fill center);
+        # stop before the budget would be crossed and spend what is left on the longest edges
+        room = len(candidates)
+        if max_triangles is not None:
+            triangles = sum(len(face.verts) - 2 for face in bm.faces)
+            room = min(room, (max_triangles - triangles) // 3)
+        if max_vertices is not None:
+            room = min(room, int((max_vertices - len(bm.verts)) / 1.5))
+        if room <= 0:
+            break
+        if room < len(candidates):
+            candidates = candidates[np.argsort(-lengths[candidates])[:room]]
+
+        bmesh.ops.subdivide_edges(bm, edges=[edges[i] for i in candidates], cuts=1, use_grid_fill=True)
+
+    # Recalculate normals outside
+    bmesh.ops.recalc_face_normals(bm, faces=bm.faces[:])
+
+    bm.to_mesh(mesh)
+    bm.free()
+    shade_smooth(mesh)
+
+def shade_smooth(mesh):
+    # Smooth shading (faces) for every polygon in one call
+    mesh.polygons.foreach_set('use_smooth', np.ones(len(mesh.polygons), dtype=bool))
+    mesh.update()
+
 def cur_filepath(img_name):
     if bpy.data.filepath:
         # Extract the directory from the file path
@@ -96,144 +280,185 @@ def cur_filepath(img_name):
     else:
         return img_name
         
-def texture_conv(uv_texture, mode = 1, brightness = 1.3):
-    # Path to the modified texture map
-    modified_texture_path = 'brightened_texture_map.png'
-    labeled_texture_path =  'labeled_texture_map.png'
-    # Applying Gaussian Blur
-    gaussian_texture_path = 'gaussian_texture_map.png'
-    # Using Bilateral Filter
-    filtered_texture_path = 'filtered_texture_map.png'
-    # Applying Non-Local Means Denoising
-    denoised_texture_path = 'denoised_texture_map.png'
-    
-    # Convert image to float to prevent overflow issues
-    texture_image_float = uv_texture.astype(np.float32)
+def image_to_array(image):
+    # Read the pixels straight out of the Blender image (float RGBA, bottom row first)
+    width, height = image.size
+    pixels = np.empty(width * height * image.channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    pixels = pixels.reshape(height, width, image.channels)[::-1]
 
-    # Define brightness factor
-    brightness_factor = brightness  # Increase brightness (e.g., 1.5 for 50% brighter)
+    # Convert to the 8-bit BGR layout cv2.imread used to give us
+    bgr = (np.clip(pixels[:, :, [2, 1, 0]], 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+    alpha = pixels[:, :, 3].copy() if image.channels == 4 else None
+    return bgr, alpha
 
-    # Adjust brightness
-    bright_texture_image = cv2.convertScaleAbs(texture_image_float * brightness_factor)
+def mesh_uv_triangles(mesh, material_index=None):
+    # Gather the UV coordinates of every loop triangle as an (n, 3, 2) array
+    if not mesh.uv_layers.active:
+        return np.empty((0, 3, 2), dtype=np.float32)
 
-    ## Non-Local Means Denoising method created the smartest uv texture map among below three methods.
-    # # Apply Gaussian Blur
-    # blurred_image = cv2.GaussianBlur(bright_texture_image, (5, 5), 0)
+    mesh.calc_loop_triangles()
+    loops = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('loops', loops)
+    uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+    mesh.uv_layers.active.data.foreach_get('uv', uvs)
+    triangles = uvs.reshape(-1, 2)[loops].reshape(-1, 3, 2)
 
-    # # Apply Bilateral Filter
-    # filtered_image = cv2.bilateralFilter(bright_texture_image, d=9, sigmaColor=75, sigmaSpace=75)
+    # Keep only the triangles drawn with the given material slot
+    if material_index is not None:
+        material_indices = np.empty(len(mesh.loop_triangles), dtype=np.int32)
+        mesh.loop_triangles.foreach_get('material_index', material_indices)
+        triangles = triangles[material_indices == material_index]
+    return triangles
 
-    # Apply Non-Local Means Denoising
-    denoised_image = cv2.fastNlMeansDenoisingColored(bright_texture_image, None, h=8, hColor=10, templateWindowSize=7, searchWindowSize=21)
+def array_to_image(bgr, name, alpha=None):
+    height, width = bgr.shape[:2]
+    image = bpy.data.images.new(name, width=width, height=height, alpha=True)
 
-    # Save the modified texture map
-    cv2.imwrite(cur_filepath(modified_texture_path), denoised_image)
+    rgba = np.ones((height, width, 4), dtype=np.float32)
+    rgba[:, :, :3] = bgr[:, :, [2, 1, 0]] / 255.0
+    if alpha is not None:
+        rgba[:, :, 3] = alpha
 
-    _, labeled_image = kMean_Img(cur_filepath(modified_texture_path), cur_filepath(labeled_texture_path))
-    
-    print(f'Modified texture saved to {modified_texture_path}')
-    print(f'Labeled texture saved to {labeled_texture_path}')
-    if (mode == 1):
-        return labeled_texture_path, labeled_image
-    else:
-        return modified_texture_path, denoised_image
+    # Push the result back in one call, flipped to Blender's bottom-up row order
+    image.pixels.foreach_set(rgba[::-1].ravel())
+    image.file_format = 'PNG'
+    image.update()
+    return image
+
+def base_color_texture_node(mat):
+    # Find the Principled BSDF and the image texture node linked to its Base Color
+    bsdf = None
+    for node in mat.node_tree.nodes:
+        if node.type == 'BSDF_PRINCIPLED':
+            bsdf = node
+            break
+    if not bsdf:
+        return None, None
 
-def import_obj_change_uv_texture(filepath, mode = 1, brightness = 1.3):
-    # Specify the path where you want to save the texture map
-    export_texture_path = "texture_map.png"
-    modified_texture_path = r""
+    for link in mat.node_tree.links:
+        if link.to_node == bsdf and link.to_socket.name == 'Base Color' and link.from_node.type == 'TEX_IMAGE':
+            return bsdf, link.from_node
+    return bsdf, None
+
+def index_image_users(objects):
+    # Map each Base Color image to the texture nodes showing it and the (mesh, slot) pairs drawing it,
+    # so an atlas shared by several parts or materials is processed once
+    image_users = {}
+    materials = set()
+    for obj in objects:
+        if not obj.data.materials:
+            print(f'Object {obj.name} has no materials.')
+            continue
+
+        for slot_index, mat in enumerate(obj.data.materials):
+            if not mat or not mat.use_nodes:
+                print('Material does not use nodes.')
+                continue
+
+            bsdf, texture_node = base_color_texture_node(mat)
+            if not bsdf:
+                print('No Principled BSDF node found in material.')
+                continue
+
+            if mat.name not in materials:
+                materials.add(mat.name)
+                bsdf.inputs['Metallic'].default_value = 0.4
+                bsdf.inputs['Roughness'].default_value = 0.8
+                print(f'{mat.name}: Metallic value set to 0.4, Roughness value set to 0.8')
+
+            if not texture_node or not texture_node.image:
+                print('No image texture node found connected to Base Color.')
+                continue
+
+            users = image_users.setdefault(texture_node.image.name, {'image': texture_node.image, 'nodes': [], 'faces': []})
+            if texture_node not in users['nodes']:
+                users['nodes'].append(texture_node)
+            users['faces'].append((obj.data, slot_index))
+    return image_users
+
+def import_obj_change_uv_texture(filepath, mode = 1, brightness = 1.3, debug = False, use_uv_mask = True, timings = None, cache = None, smoothing = 'bmesh', smoothing_options = None, texture_workers = None):
+    # Intermediate textures are written next to the blend file only in debug mode
+    debug_dir = os.path.dirname(cur_filepath("texture_map.png")) if debug else None
 
     if os.path.exists(filepath):
-        bpy.ops.import_scene.gltf(filepath=filepath)
+        with stage_timer(timings, 'import'):
+            bpy.ops.import_scene.gltf(filepath=filepath)
+            profiling.annotate(file_bytes=os.path.getsize(filepath))
     else:
         print("File does not exist:", filepath)
 
+    mesh_objects = [obj for obj in bpy.context.selected_objects if obj.type == 'MESH']
+    return smooth_and_retexture(mesh_objects, mode, brightness, debug_dir, use_uv_mask, timings, cache, smoothing, smoothing_options, texture_workers)
+
+def smooth_and_retexture(mesh_objects, mode = 1, brightness = 1.3, debug_dir = None, use_uv_mask = True, timings = None, cache = None, smoothing = 'bmesh', smoothing_options = None, texture_workers = None):
+    # Smoothing and texture clean-up of objects already in the scene (imported, or left by an earlier stage);
+    # texture_workers caps the denoising threads (default: one per CPU)
+
+    # Subdivision keeps the UVs inside the original triangles, so the UV coverage is read before
+    # smoothing: the same mask from a fraction of the triangles to rasterize
+    image_users = index_image_users(mesh_objects)
+    uv_triangles = {}
+    if use_uv_mask:
+        for name, users in image_users.items():
+            uv_triangles[name] = np.concatenate([mesh_uv_triangles(mesh, slot_index) for mesh, slot_index in users['faces']])
+
     # Apply smooth shading
-    for obj in bpy.context.selected_objects:
-        if obj.type == 'MESH':
-            bpy.context.view_layer.objects.active = obj
-            
-            add_subdivision_and_recalculate_normals(obj)
-            
-            bpy.ops.object.mode_set(mode='OBJECT')
-                
-            # Ensure the object has an active material with a texture
-            if obj.data.materials:
-                mat = obj.data.materials[0]
-                if mat.node_tree:
-                    texture_node = None
-                    for node in mat.node_tree.nodes:
-                        if node.type == 'TEX_IMAGE':
-                            texture_node = node
-                            break
-
-                    if texture_node and texture_node.image:
-                        # Save the texture image
-                        texture_node.image.save_render(filepath=cur_filepath(export_texture_path))
-                        print(f'Texture saved to {export_texture_path}')
-
-                        # Load the texture map
-                        texture_image = cv2.imread(cur_filepath(export_texture_path))
-                        
-                        modified_texture_path, _ = texture_conv(texture_image, mode, brightness)
-                    else:
-                        print('No image texture found on the material.')
-                else:
-                    print('Material does not use nodes.')
-            else:
-                print('Object has no materials.')
-
-            # Change Base Color node's image as a modified texture image
-            if obj:
-                # Switch to Object Mode
-                bpy.ops.object.mode_set(mode='OBJECT')
-
-                # Ensure the object has an active material
-                if obj.data.materials:
-                    mat = obj.data.materials[0]
-                    
-                    if mat.use_nodes:
-                        # Get the node tree of the material
-                        nodes = mat.node_tree.nodes
-                        links = mat.node_tree.links
-                        
-                        # Check if there is a Principled BSDF node
-                        bsdf = None
-                        for node in nodes:
-                            if node.type == 'BSDF_PRINCIPLED':
-                                bsdf = node
-                                break
-                        
-                        if bsdf:
-                            # Set the Metallic value to 1
-                            bsdf.inputs['Metallic'].default_value = 0.4
-                            bsdf.inputs['Roughness'].default_value = 0.8
-                            print('Metallic value set to 0.4, Roughness value set to 0.8')
-                            
-                            # Check if there's an existing texture node connected to Base Color
-                            texture_node = None
-                            for link in links:
-                                if link.to_node == bsdf and link.to_socket.name == 'Base Color':
-                                    texture_node = link.from_node
-                                    break
-                            
-                            if texture_node and texture_node.type == 'TEX_IMAGE':
-                                # Load the new image
-                                new_image = bpy.data.images.load(cur_filepath(modified_texture_path))
-                                
-                                # Update the image in the texture node
-                                texture_node.image = new_image
-                                print(f'Base Color updated with new image: {modified_texture_path}')
-                            else:
-                                print('No image texture node found connected to Base Color.')
-                        else:
-                            print('No Principled BSDF node found in material.')
-                    else:
-                        print('Material does not use nodes.')
-                else:
-                    print('Object has no materials.')
-            else:
-                print('No active object selected.')
+    with stage_timer(timings, 'subdivide'):
+        triangles, vertices = mesh_counts({obj.data.name: obj.data for obj in mesh_objects}.values())
+        profiling.annotate(method=smoothing, objects=len(mesh_objects), input_triangles=triangles, input_vertices=vertices)
+        mesh_report = smooth_meshes(mesh_objects, smoothing, cache=cache, **(smoothing_options or {}))
+        profiling.annotate(triangles=mesh_report['triangles'], vertices=mesh_report['vertices'])
+
+    # Process every unique Base Color image exactly once, across all objects and material slots
+    for name, users in image_users.items():
+        image = users['image']
+        with stage_timer(timings, 'texture'):
+            # Read the texture map straight from the Blender image
+            texture_image, texture_alpha = image_to_array(image)
+            profiling.annotate(image=image.name, width=texture_image.shape[1], height=texture_image.shape[0])
+
+            # Only filter the texels covered by the UV islands of every face drawn with this image
+            mask = None
+            if use_uv_mask:
+                mask = uv_coverage_mask(uv_triangles[name], texture_image.shape)
+
+            _, modified_texture = texture_conv(texture_image, mode, brightness, debug_dir, workers=texture_workers, mask=mask, cache=cache)
+            modified_image = array_to_image(modified_texture, image.name + '_modified', texture_alpha)
+
+        # Re-point every texture node that used the original to the single result
+        for texture_node in users['nodes']:
+            texture_node.image = modified_image
+        print(f'Base Color of {len(users["nodes"])} texture node(s) updated with new image: {modified_image.name}')
+
+    return mesh_report
+
+def apply_modifiers(objects):
+    # Bake the modifier stack (e.g. the Subdivision Surface of the 'modifier' method) into the mesh data,
+    # as export_apply does for the GLB, so later stages see the final geometry
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    for obj in objects:
+        if not obj.modifiers:
+            continue
+        mesh = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph), preserve_all_data_layers=True, depsgraph=depsgraph)
+        old_mesh = obj.data
+        obj.modifiers.clear()
+        obj.data = mesh
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+
+def export_glb(filepath, timings = None, optimize = None):
+    # Export the processed GLB file; with optimize (glb_optimize options) the export is rewritten
+    # with palette/limited-size textures and quantized attributes, and the size report is returned
+    def export(path):
+        with stage_timer(timings, 'export'):
+            # export_apply evaluates the Subdivision Surface modifiers of the 'modifier' smoothing method (armatures are left alone)
+            bpy.ops.export_scene.gltf(filepath=path, export_format='GLB', export_apply=True)
+
+    if optimize is None:
+        export(filepath)
+        return None
+    return optimized_export(export, filepath, optimize, lambda: stage_timer(timings, 'optimize'))
 
 if __name__ == "__main__":
     basepath = r"D:\Projects\GLB-preprocess\characters\4"
@@ -245,8 +470,10 @@ if __name__ == "__main__":
     mode = 2 # 1: KMean, 2: Denoise
     brightness = 1.3
     
+    # Set GLB_PROFILE_REPORT (and GLB_PROFILE_DIR) to record a run report, see profiling.py
+    profiling.start_from_env()
+
     del_existing_objs()
     import_obj_change_uv_texture(filepath, mode, brightness)
         
-    # Export the processed GLB file
-    bpy.ops.export_scene.gltf(filepath=os.path.join(basepath, f'output_smoothed_{mode}.glb'), export_format='GLB')
+    export_glb(os.path.join(basepath, f'output_smoothed_{mode}.glb'))
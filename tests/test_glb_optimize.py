@@ -0,0 +1,83 @@
+import os
+import sys
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from glb_optimize import encode_indexed_png, image_palette, optimize_glb
+from glb_texture import GLB, pack_glb, decode_image
+from synthetic import write_synthetic_glb, synthetic_texture
+
+def palette_image(colors, width, height, with_alpha, seed=0):
+    # An image using exactly `colors` distinct colours, every one of them at least once
+    rng = np.random.default_rng(seed)
+    table = rng.choice(1 << 24, colors, replace=False)
+    table = np.stack([table & 255, table >> 8 & 255, table >> 16], axis=1).astype(np.uint8)
+    alphas = rng.integers(0, 256, colors).astype(np.uint8) if with_alpha else np.full(colors, 255, dtype=np.uint8)
+    choice = rng.permutation(np.resize(np.arange(colors), width * height)).reshape(height, width)
+    return table[choice], (alphas[choice] if with_alpha else None)
+
+@pytest.mark.parametrize('colors', [2, 3, 16, 17, 200])
+@pytest.mark.parametrize('width', [1, 3, 7, 33])
+@pytest.mark.parametrize('with_alpha', [False, True])
+def test_palette_png_round_trip(colors, width, with_alpha):
+    height = max(-(-colors // width), 5)
+    bgr, alpha = palette_image(colors, width, height, with_alpha, seed=colors * width)
+    palette, indices = image_palette(bgr, alpha)
+    assert len(palette) == colors
+
+    decoded, decoded_alpha = decode_image(encode_indexed_png(indices, palette))
+    assert np.array_equal(decoded, bgr)
+    if with_alpha:
+        assert np.array_equal(decoded_alpha, alpha)
+    else:
+        assert decoded_alpha is None
+
+def test_quantized_accessors_stay_within_a_step(tmp_path):
+    input_path, output_path = str(tmp_path / 'in.glb'), str(tmp_path / 'out.glb')
+    write_synthetic_glb(input_path, 3000, 64, normals=True)
+    report = optimize_glb(input_path, output_path)
+    assert report['quantized_accessors'] == 3
+
+    with GLB(input_path) as before, GLB(output_path) as after:
+        attributes = before.gltf['meshes'][0]['primitives'][0]['attributes']
+        for semantic, step in (('TEXCOORD_0', 1 / 65535), ('NORMAL', 1 / 127)):
+            index = attributes[semantic]
+            assert after.gltf['accessors'][index]['normalized']
+            assert np.abs(after.accessor(index) - before.accessor(index)).max() <= step
+        index = before.gltf['meshes'][0]['primitives'][0]['indices']
+        assert after.gltf['accessors'][index]['componentType'] == 5123
+        assert np.array_equal(after.accessor(index), before.accessor(index))
+        assert np.array_equal(after.accessor(attributes['POSITION']), before.accessor(attributes['POSITION']))
+        assert 'KHR_mesh_quantization' in after.gltf['extensionsRequired']
+
+def test_extension_view_survives_renumbering(tmp_path):
+    # A Draco-style primitive: the attribute accessors have no buffer view and the compressed
+    # stream is only referenced from the extension, behind a view nothing uses
+    input_path, output_path = str(tmp_path / 'in.glb'), str(tmp_path / 'out.glb')
+    ok, png = cv2.imencode('.png', synthetic_texture(64))
+    stream = bytes(range(256)) * 3
+    gltf = {
+        'asset': {'version': '2.0'},
+        'extensionsUsed': ['KHR_draco_mesh_compression'],
+        'extensionsRequired': ['KHR_draco_mesh_compression'],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0}, 'indices': 1, 'material': 0, 'extensions': {
+            'KHR_draco_mesh_compression': {'bufferView': 1, 'attributes': {'POSITION': 0}}}}]}],
+        'materials': [{'pbrMetallicRoughness': {'baseColorTexture': {'index': 0}}}],
+        'textures': [{'source': 0}],
+        'images': [{'bufferView': 2, 'mimeType': 'image/png'}],
+        'accessors': [{'componentType': 5126, 'count': 3, 'type': 'VEC3', 'min': [0, 0, 0], 'max': [1, 1, 1]},
+                      {'componentType': 5125, 'count': 3, 'type': 'SCALAR'}],
+        'bufferViews': [{'buffer': 0}, {'buffer': 0}, {'buffer': 0}],
+        'buffers': [{}],
+    }
+    pack_glb(input_path, gltf, [b'\0' * 100, stream, png.tobytes()])
+    optimize_glb(input_path, output_path)
+
+    with GLB(output_path) as glb:
+        assert len(glb.gltf['bufferViews']) == 2
+        draco = glb.gltf['meshes'][0]['primitives'][0]['extensions']['KHR_draco_mesh_compression']
+        assert bytes(glb.buffer_view(draco['bufferView'])) == stream
+        assert bytes(glb.buffer_view(glb.gltf['images'][0]['bufferView'])) == png.tobytes()
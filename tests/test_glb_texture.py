@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from glb_texture import GLB, process_glb, decode_image
+from synthetic import write_synthetic_glb
+
+@pytest.mark.parametrize('mode', [1, 2])
+def test_process_glb_replaces_only_the_image(tmp_path, mode):
+    input_path, output_path = str(tmp_path / 'in.glb'), str(tmp_path / 'out.glb')
+    write_synthetic_glb(input_path, 3000, 128, normals=True)
+    process_glb(input_path, output_path, mode)
+
+    with GLB(input_path) as before, GLB(output_path) as after:
+        assert after.gltf['accessors'] == before.gltf['accessors']
+        for accessor in before.gltf['accessors']:
+            view = accessor['bufferView']
+            assert bytes(after.buffer_view(view)) == bytes(before.buffer_view(view))
+
+        image_view = before.gltf['images'][0]['bufferView']
+        assert after.gltf['images'] == before.gltf['images']
+        assert bytes(after.buffer_view(image_view)) != bytes(before.buffer_view(image_view))
+        original, _ = decode_image(before.buffer_view(image_view))
+        processed, _ = decode_image(after.buffer_view(image_view))
+        assert processed.shape == original.shape
+
+def open_descriptors():
+    return len(os.listdir('/proc/self/fd'))
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc to count open files')
+@pytest.mark.parametrize('content', [b'not a glb file at all', b'glTF', b''])
+def test_bad_glb_is_closed_on_error(tmp_path, content):
+    path = tmp_path / 'bad.glb'
+    path.write_bytes(content)
+    before = open_descriptors()
+    # The traceback in error keeps the half-built GLB alive, so its file must already be closed
+    with pytest.raises(ValueError) as error:
+        GLB(str(path))
+    assert open_descriptors() == before
+    assert 'bad.glb' in str(error.value)
@@ -0,0 +1,48 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# Runs where the bpy module is installed, or inside Blender:
+#   blender --background --factory-startup --python-expr "import pytest; pytest.main(['tests/test_mesh_cache.py'])"
+bpy = pytest.importorskip('bpy')
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from smooth_spotless import reset_scene, smooth_meshes, mesh_to_arrays
+from artifact_cache import ArtifactCache
+from synthetic import write_synthetic_glb
+
+def corner_normals(mesh):
+    normals = np.empty(len(mesh.corner_normals) * 3, dtype=np.float32)
+    mesh.corner_normals.foreach_get('vector', normals)
+    return normals
+
+def import_glb(path):
+    reset_scene()
+    bpy.ops.import_scene.gltf(filepath=path)
+    return [obj for obj in bpy.context.selected_objects if obj.type == 'MESH']
+
+@pytest.mark.parametrize('method', ['bmesh', 'operator'])
+def test_imported_glb_hits_the_mesh_cache(tmp_path, capsys, method):
+    path = str(tmp_path / 'character.glb')
+    write_synthetic_glb(path, 2000, 64, normals=True)
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+
+    objects = import_glb(path)
+    # The importer keeps the file's normals as custom split normals
+    assert objects[0].data.has_custom_normals
+    smooth_meshes(objects, method, cache=cache)
+    computed = mesh_to_arrays(objects[0].data)
+    computed_normals = corner_normals(objects[0].data)
+    assert 'Mesh cache hit' not in capsys.readouterr().out
+
+    objects = import_glb(path)
+    smooth_meshes(objects, method, cache=cache)
+    assert 'Mesh cache hit' in capsys.readouterr().out
+    cached = mesh_to_arrays(objects[0].data)
+    assert np.allclose(corner_normals(objects[0].data), computed_normals, atol=1e-5)
+
+    assert computed.keys() == cached.keys()
+    for name in computed:
+        assert np.array_equal(computed[name], cached[name]), name
@@ -0,0 +1,55 @@
+import os
+import sys
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from texture_pipeline import ClusteringImgColor, FAST_FIT_TOLERANCE, denoise_tiled, nl_means, texture_tiles, texture_conv
+from artifact_cache import ArtifactCache
+from synthetic import synthetic_texture
+
+@pytest.mark.parametrize('size, seed', [(512, 0), (512, 1), (1024, 0), (1024, 1)])
+def test_fast_fit_within_tolerance_of_full_fit(size, seed):
+    rgb = cv2.cvtColor(synthetic_texture(size, seed=seed), cv2.COLOR_BGR2RGB)
+    hsv = ClusteringImgColor.convert_rgb_to_hsv(rgb)
+
+    errors = {}
+    for fit_mode in ('full', 'fast'):
+        labels, centers = ClusteringImgColor.cluster_pixels(hsv, n_clusters=10, fit_mode=fit_mode)
+        errors[fit_mode] = ClusteringImgColor.quantization_error(hsv, labels, centers)
+
+    assert errors['fast'] <= errors['full'] * (1.0 + FAST_FIT_TOLERANCE)
+
+@pytest.mark.parametrize('shape, tile_size', [((300, 300), 128), ((257, 391), 100), ((333, 200), 64)])
+@pytest.mark.parametrize('use_processes', [False, True])
+def test_denoise_tiled_matches_untiled(shape, tile_size, use_processes):
+    image = synthetic_texture(max(shape), seed=2)[:shape[0], :shape[1]].copy()
+    tiled = denoise_tiled(image, tile_size, workers=2, use_processes=use_processes)
+    assert np.array_equal(tiled, nl_means(image))
+
+def test_denoise_tiled_passes_uncovered_tiles_through():
+    image = synthetic_texture(320, seed=3)
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    mask[10:90, 150:230] = 255
+    tiled = denoise_tiled(image, 80, workers=2, mask=mask)
+
+    covered = np.zeros(image.shape[:2], dtype=bool)
+    for y0, y1, x0, x1 in texture_tiles(image.shape, 80):
+        covered[y0:y1, x0:x1] = mask[y0:y1, x0:x1].any()
+    assert np.array_equal(tiled[~covered], image[~covered])
+    assert np.array_equal(tiled[covered], nl_means(image)[covered])
+
+def test_texture_cache_key_covers_tile_size(tmp_path):
+    image = synthetic_texture(300, seed=4)
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    mask[20:60, 20:200] = 255
+    cache = ArtifactCache(str(tmp_path))
+
+    _, first = texture_conv(image, 2, mask=mask, cache=cache, tile_size=256)
+    _, hit = texture_conv(image, 2, mask=mask, cache=cache, tile_size=256)
+    _, other_tiles = texture_conv(image, 2, mask=mask, cache=cache, tile_size=64)
+    assert np.array_equal(hit, first)
+    assert np.array_equal(other_tiles, texture_conv(image, 2, mask=mask, tile_size=64)[1])
+    assert not np.array_equal(other_tiles, first)
@@ -0,0 +1,249 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cv2 # "C:\Program Files\Blender Foundation\Blender <version>\python\bin\python.exe" -m pip install opencv-python
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+import profiling
+
+# Texture stages shared by the Blender scripts; everything here works on NumPy BGR arrays and does not need bpy
+
+# The sampled fast fit may quantize up to this fraction worse than the full KMeans fit, measured as the
+# mean absolute difference between each pixel and its cluster center (see quantization_error)
+FAST_FIT_TOLERANCE = 0.15
+
+# Non-Local Means settings texture_conv denoises with
+DENOISE_PARAMS = {'h': 8, 'hColor': 10, 'templateWindowSize': 7, 'searchWindowSize': 21}
+
+class ClusteringImgColor:    
+    def convert_rgb_to_hsv(image):
+        # Convert from RGB to HSV using OpenCV
+        return cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+
+    def sample_pixels(pixels, sample_size, sampling='random', random_state=0):
+        # Pick a subset of pixels to fit the model on
+        if sample_size is None or sample_size >= len(pixels):
+            return pixels
+
+        rng = np.random.default_rng(random_state)
+        if sampling == 'stratified':
+            # One random pixel from each of sample_size equal-sized strata, so every region of the texture is represented
+            edges = np.linspace(0, len(pixels), sample_size + 1).astype(np.int64)
+            offsets = (rng.random(sample_size) * (edges[1:] - edges[:-1])).astype(np.int64)
+            return pixels[edges[:-1] + offsets]
+
+        return pixels[rng.choice(len(pixels), size=sample_size, replace=False)]
+
+    def label_pixels(kmeans, pixels, chunk_size=1 << 20):
+        # Predict the cluster of every pixel, chunk by chunk to bound the temporary distance matrix
+        labels = np.empty(len(pixels), dtype=np.int32)
+        for start in range(0, len(pixels), chunk_size):
+            labels[start:start + chunk_size] = kmeans.predict(pixels[start:start + chunk_size])
+        return labels
+
+    def cluster_pixels(image, n_clusters=5, fit_mode='fast', sample_size=200000, sampling='random', chunk_size=1 << 20, mask=None):
+        # Reshape the image to a 2D array of pixels
+        pixels = image.reshape(-1, 3)
+
+        # Only texels covered by the UV islands take part, so the padding color does not pull the centers
+        if mask is not None:
+            covered = mask.reshape(-1) > 0
+            pixels = pixels[covered]
+        pixels = pixels.astype(np.float32)
+
+        if fit_mode == 'full':
+            # Create and fit the KMeans model on every pixel
+            kmeans = KMeans(n_clusters=n_clusters, random_state=0).fit(pixels)
+            labels = kmeans.labels_
+        else:
+            # Fit on a pixel sample only; MiniBatchKMeans keeps memory flat on 4K textures
+            sample = ClusteringImgColor.sample_pixels(pixels, sample_size, sampling)
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=0, batch_size=4096, n_init=3).fit(sample)
+
+            # Predict the cluster for each pixel
+            labels = ClusteringImgColor.label_pixels(kmeans, pixels, chunk_size)
+
+        # Get the cluster centers (mean colors)
+        cluster_centers = kmeans.cluster_centers_.astype(np.uint8)
+
+        # Texels outside the UV islands take the dominant color, so the image stays on the palette
+        if mask is not None:
+            covered_labels = labels
+            labels = np.full(covered.shape, np.bincount(covered_labels, minlength=n_clusters).argmax(), dtype=covered_labels.dtype)
+            labels[covered] = covered_labels
+
+        return labels, cluster_centers
+
+    def quantization_error(image, labels, cluster_centers):
+        # Mean absolute difference between every pixel and the center it was mapped to
+        pixels = image.reshape(-1, 3).astype(np.float32)
+        return float(np.abs(pixels - cluster_centers[labels].astype(np.float32)).mean())
+
+    def apply_kmeans_to_image(labels, cluster_centers, image_shape):
+        # Map each pixel to its cluster center color with a single lookup
+        new_pixels = cluster_centers[labels]
+
+        # Reshape the result back to the original image shape
+        new_image = new_pixels.reshape(image_shape)
+
+        return new_image
+
+    def convert_hsv_to_rgb(image):
+        # Convert from HSV to RGB using OpenCV
+        return cv2.cvtColor(image, cv2.COLOR_HSV2RGB)
+
+    def kmean_clustering(image, n_clusters, fit_mode='fast', sample_size=200000, sampling='random', mask=None):
+        # Convert RGB to HSV
+        hsv_image = ClusteringImgColor.convert_rgb_to_hsv(image)
+
+        # Cluster the pixels in the HSV color space
+        labels, cluster_centers = ClusteringImgColor.cluster_pixels(hsv_image, n_clusters=n_clusters, fit_mode=fit_mode, sample_size=sample_size, sampling=sampling, mask=mask)  # Adjust number of clusters as needed
+
+        # Apply the K-Means result to the image
+        clustered_hsv_image = ClusteringImgColor.apply_kmeans_to_image(labels, cluster_centers, hsv_image.shape)
+        
+        # Convert the clustered HSV image back to RGB
+        clustered_rgb_image = ClusteringImgColor.convert_hsv_to_rgb(clustered_hsv_image)
+        
+        # Convert RGB back to BGR for OpenCV
+        clustered_bgr_image = cv2.cvtColor(clustered_rgb_image, cv2.COLOR_RGB2BGR)
+
+        return clustered_rgb_image, clustered_bgr_image
+    
+def brighten_texture(uv_texture, brightness=1.3):
+    # Convert image to float to prevent overflow issues
+    texture_image_float = uv_texture.astype(np.float32)
+
+    # Adjust brightness (e.g., 1.5 for 50% brighter)
+    return cv2.convertScaleAbs(texture_image_float * brightness)
+
+def texture_tiles(shape, tile_size):
+    # Split an image into tile_size x tile_size boxes (y0, y1, x0, x1); edge tiles are smaller
+    height, width = shape[:2]
+    return [(y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width))
+            for y0 in range(0, height, tile_size)
+            for x0 in range(0, width, tile_size)]
+
+def uv_coverage_mask(uv_triangles, shape, dilation=4):
+    # Rasterize the mesh's UV triangles (n, 3, 2) into a mask of the texels it actually samples
+    height, width = shape[:2]
+
+    # Move each triangle back into the 0-1 tile its centroid lies in, for UVs that wrap
+    uvs = uv_triangles - np.floor(uv_triangles.mean(axis=1, keepdims=True))
+
+    # UV (0, 0) is the bottom-left corner of the texture; use 4 bits of subpixel precision
+    points = np.empty(uvs.shape, dtype=np.int32)
+    points[:, :, 0] = np.round(uvs[:, :, 0] * width * 16)
+    points[:, :, 1] = np.round((1.0 - uvs[:, :, 1]) * height * 16)
+
+    # fillPoly XORs overlapping polygons (mirrored islands), so fill the triangles one by one
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for triangle in points:
+        cv2.fillConvexPoly(mask, triangle, 255, shift=4)
+
+    # Grow the islands a little so filtering does not bleed the padding into the edges
+    if dilation > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * dilation + 1, 2 * dilation + 1))
+        mask = cv2.dilate(mask, kernel)
+    return mask
+
+def nl_means(image, h=8, hColor=10, templateWindowSize=7, searchWindowSize=21):
+    # Apply Non-Local Means Denoising
+    return cv2.fastNlMeansDenoisingColored(image, None, h=h, hColor=hColor, templateWindowSize=templateWindowSize, searchWindowSize=searchWindowSize)
+
+def denoise_tiled(image, tile_size=512, workers=None, use_processes=False, mask=None, h=8, hColor=10, templateWindowSize=7, searchWindowSize=21):
+    params = dict(h=h, hColor=hColor, templateWindowSize=templateWindowSize, searchWindowSize=searchWindowSize)
+    height, width = image.shape[:2]
+    if tile_size is None or (height <= tile_size and width <= tile_size):
+        return nl_means(image, **params)
+
+    # A pixel only sees patches inside its search window, so a halo of search + template radius
+    # makes every tile interior identical to the untiled result and the stitch seamless
+    halo = searchWindowSize // 2 + templateWindowSize // 2
+    boxes = texture_tiles(image.shape, tile_size)
+
+    # Tiles without any covered texel are passed through untouched
+    denoised_image = image.copy()
+    if mask is not None:
+        boxes = [(y0, y1, x0, x1) for y0, y1, x0, x1 in boxes if mask[y0:y1, x0:x1].any()]
+    padded = [(max(y0 - halo, 0), min(y1 + halo, height), max(x0 - halo, 0), min(x1 + halo, width)) for y0, y1, x0, x1 in boxes]
+
+    # cv2 releases the GIL, so threads are enough; processes are there for builds that do not
+    pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with pool_class(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(nl_means, image[py0:py1, px0:px1], **params) for py0, py1, px0, px1 in padded]
+
+        for (y0, y1, x0, x1), (py0, py1, px0, px1), future in zip(boxes, padded, futures):
+            denoised_image[y0:y1, x0:x1] = future.result()[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+    return denoised_image
+
+def denoise_texture(bright_texture_image, tile_size=512, workers=None, mask=None, **params):
+    ## Non-Local Means Denoising method created the smartest uv texture map among below three methods.
+    # # Apply Gaussian Blur
+    # blurred_image = cv2.GaussianBlur(bright_texture_image, (5, 5), 0)
+
+    # # Apply Bilateral Filter
+    # filtered_image = cv2.bilateralFilter(bright_texture_image, d=9, sigmaColor=75, sigmaSpace=75)
+
+    # Apply Non-Local Means Denoising, tile by tile on a worker pool
+    return denoise_tiled(bright_texture_image, tile_size, workers, mask=mask, **params)
+
+def quantize_texture(denoised_image, n_cluster=10, fit_mode='fast', mask=None):
+    denoised_rgb = cv2.cvtColor(denoised_image, cv2.COLOR_BGR2RGB)
+    _, clustered_bgr_image = ClusteringImgColor.kmean_clustering(denoised_rgb, n_cluster, fit_mode, mask=mask)
+    return clustered_bgr_image
+
+def texture_conv(uv_texture, mode = 1, brightness = 1.3, debug_dir=None, tile_size=512, workers=None, mask=None, cache=None,
+                 denoise_params=None, n_cluster=10, fit_mode='fast'):
+    # Path to the modified texture map
+    modified_texture_path = 'brightened_texture_map.png'
+    labeled_texture_path =  'labeled_texture_map.png'
+
+    # An empty coverage mask means the UVs could not be read; filter the whole texture then
+    if mask is not None and not mask.any():
+        mask = None
+
+    denoise_params = dict(DENOISE_PARAMS, **(denoise_params or {}))
+
+    # Re-runs and shared skins hit the cache; debug runs always recompute to write the intermediates.
+    # The key holds every setting that changes the pixels (tiles matter where a mask skips some of them)
+    if cache is not None and debug_dir is None:
+        cache_key = cache.key('texture', [uv_texture, mask], dict(mode=mode, brightness=brightness, tile_size=tile_size,
+                                                                  n_cluster=n_cluster, fit_mode=fit_mode, **denoise_params))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f'Texture cache hit: {cache_key}')
+            return None, cached['image']
+
+    height, width = uv_texture.shape[:2]
+    covered = int(np.count_nonzero(mask)) if mask is not None else height * width
+    with profiling.stage('brighten', width=width, height=height):
+        bright_texture_image = brighten_texture(uv_texture, brightness)
+    with profiling.stage('denoise', width=width, height=height, covered_texels=covered, tile_size=tile_size):
+        denoised_image = denoise_texture(bright_texture_image, tile_size, workers, mask, **denoise_params)
+
+    # K-Means only runs when its result is actually used
+    labeled_image = None
+    if mode == 1:
+        with profiling.stage('kmeans', width=width, height=height, covered_texels=covered):
+            labeled_image = quantize_texture(denoised_image, n_cluster, fit_mode, mask=mask)
+
+    # Intermediate images are only written to disk when debug artifacts are requested
+    if debug_dir is None:
+        modified_texture_path = labeled_texture_path = None
+    else:
+        modified_texture_path = os.path.join(debug_dir, modified_texture_path)
+        cv2.imwrite(modified_texture_path, denoised_image)
+        print(f'Modified texture saved to {modified_texture_path}')
+        if labeled_image is not None:
+            labeled_texture_path = os.path.join(debug_dir, labeled_texture_path)
+            cv2.imwrite(labeled_texture_path, labeled_image)
+            print(f'Labeled texture saved to {labeled_texture_path}')
+
+    if cache is not None and debug_dir is None:
+        cache.put(cache_key, image=labeled_image if mode == 1 else denoised_image)
+
+    if (mode == 1):
+        return labeled_texture_path, labeled_image
+    else:
+        return modified_texture_path, denoised_image
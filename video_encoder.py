@@ -0,0 +1,79 @@
+import queue
+import threading
+import cv2
+import numpy as np
+
+# Output stage shared by animation.py: logo overlay and a background video encoder fed through a queue.
+# Needs no bpy, so frames can come from PNGs on disk or straight from Blender's render result.
+
+# The video used to be written at 120 fps with every frame repeated 7 times
+OUTPUT_FPS = 120 / 7
+
+class LogoOverlay:
+    # Logo pasted into the bottom-right corner; the region slice and the alpha mask
+    # (non-white logo pixels) are computed once instead of per frame
+    def __init__(self, logo_path, frame_shape, margin=30, scale=3):
+        logo = cv2.imread(logo_path)
+        self.logo = cv2.resize(logo, (logo.shape[1] // scale, logo.shape[0] // scale))
+        self.alpha = (self.logo[:, :, :3] != [255, 255, 255]).any(axis=2)[:, :, None]
+
+        height, width = frame_shape[:2]
+        logo_height, logo_width = self.logo.shape[:2]
+        self.region = (slice(height - logo_height - margin, height - margin), slice(width - logo_width - margin, width - margin))
+
+    def apply(self, frame):
+        np.copyto(frame[self.region], self.logo, where=self.alpha)
+        return frame
+
+class FrameEncoder:
+    # Frames are put on a bounded queue and encoded by a background thread, so rendering and
+    # encoding overlap; the bound keeps memory flat when the encoder falls behind
+    def __init__(self, output_video_path, fps=OUTPUT_FPS, logo_path=None, queue_size=8):
+        self.output_video_path = output_video_path
+        self.fps = fps
+        self.logo_path = logo_path
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.count = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        if self.error:
+            raise self.error
+        self.frames.put(frame)
+
+    def run(self):
+        video = None
+        overlay = None
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+
+                # The writer and the overlay need the frame size, so they are set up on the first frame
+                if video is None:
+                    video = cv2.VideoWriter(self.output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (frame.shape[1], frame.shape[0]))
+                    if self.logo_path:
+                        overlay = LogoOverlay(self.logo_path, frame.shape)
+
+                if overlay:
+                    overlay.apply(frame)
+                video.write(frame)
+                self.count += 1
+        except Exception as e:
+            self.error = e
+            # Keep draining so producers blocked on a full queue are released
+            while self.frames.get() is not None:
+                pass
+        finally:
+            if video is not None:
+                video.release()
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+        print(f"Video saved to {self.output_video_path} ({self.count} frames)")
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+
+# Waits for inputs written by other processes to be complete, without sleep-polling where possible.
+# On Linux the parent folders are watched with inotify and the inputs are re-checked on every event;
+# elsewhere (or if inotify is unavailable) the inputs are polled. An input counts as complete once
+# its marker file (<path>.done) exists or its size and mtime have not changed for `settle` seconds;
+# inputs last modified longer than that ago are complete right away.
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+MARKER_SUFFIX = '.done'
+
+class InotifyEvents:
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watched = set()
+
+    def watch(self, directories):
+        for directory in directories:
+            if directory not in self.watched and os.path.isdir(directory):
+                if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) >= 0:
+                    self.watched.add(directory)
+
+    def wait(self, timeout):
+        # Block until something changes in a watched folder or the timeout passes
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+        return bool(readable)
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingEvents:
+    def __init__(self, interval=0.25):
+        self.interval = interval
+
+    def watch(self, directories):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval) if timeout is not None else self.interval)
+        return False
+
+    def close(self):
+        pass
+
+def event_source():
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyEvents()
+        except (OSError, AttributeError):
+            pass
+    return PollingEvents()
+
+def watch_directories(paths):
+    # The nearest existing folder of each path (so its creation is seen) plus the path itself if it is a folder
+    directories = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            directories.add(path)
+        parent = os.path.dirname(path)
+        while parent and not os.path.isdir(parent):
+            parent = os.path.dirname(parent)
+        directories.add(parent)
+    return directories
+
+def file_signature(path):
+    # Size and mtime of a file, or of every file under a folder; None while the path is missing
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns)
+    if os.path.isdir(path):
+        entries = []
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                entries.append((name, stat.st_size, stat.st_mtime_ns))
+        return tuple(entries)
+    return None
+
+def last_modified(paths):
+    # Newest mtime (seconds since the epoch) of the files, or of the files under the folders, in paths
+    newest = 0.0
+    for path in paths:
+        files = [path] if os.path.isfile(path) else [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        for file in files:
+            try:
+                newest = max(newest, os.stat(file).st_mtime)
+            except FileNotFoundError:
+                pass
+    return newest
+
+def wait_until(signature, paths, timeout=None, settle=1.0, modified=None):
+    # Wait until signature() is not None and either stops changing for `settle` seconds or returns
+    # the string 'ready'. `paths` (a list, or a function returning one) are the inputs whose
+    # folders are watched for changes. modified() returns when the inputs were last written; the
+    # time since then counts towards the settle window, so inputs that are already complete do not wait.
+    events = event_source()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        last, stable_since = None, None
+        while True:
+            watched_paths = paths() if callable(paths) else paths
+            events.watch(watch_directories(watched_paths))
+            current = signature()
+            now = time.monotonic()
+            if current == 'ready':
+                return
+            if current != last:
+                last, stable_since = current, now
+                if current is not None and modified is not None:
+                    stable_since = now - max(time.time() - modified(), 0.0)
+            elif current is not None and now - stable_since >= settle:
+                return
+
+            if deadline is not None and now >= deadline:
+                raise TimeoutError(f'Timed out waiting for {", ".join(watched_paths)}')
+
+            # Sleep until the next event, the end of the settle window or the deadline
+            wait = settle - (now - stable_since) if current is not None else None
+            if deadline is not None:
+                wait = deadline - now if wait is None else min(wait, deadline - now)
+            events.wait(max(wait, 0.0) if wait is not None else None)
+    finally:
+        events.close()
+
+def paths_signature(paths):
+    # 'ready' when every path has its marker, None while any is missing, else their file signatures
+    if all(os.path.exists(path + MARKER_SUFFIX) for path in paths):
+        return 'ready'
+    signatures = [file_signature(path) for path in paths]
+    return None if any(s is None for s in signatures) else tuple(signatures)
+
+def wait_for_paths(paths, timeout=None, settle=1.0):
+    # Wait for files or folders to exist and be completely written
+    wait_until(lambda: paths_signature(paths), paths, timeout, settle, lambda: last_modified(paths))
+
+def wait_for_removal(path, timeout=None):
+    def signature():
+        return 'ready' if not os.path.exists(path) else None
+
+    wait_until(signature, [path], timeout)